@@ -0,0 +1,99 @@
+import json
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.bot.common.ttl_store import TTLStore
+from app.database.orm_query import orm_get_fsm_record, orm_save_fsm_records
+from app.database.writer import run_write
+
+logger = logging.getLogger(__name__)
+
+Record = Tuple[Optional[str], Dict[str, Any]]
+
+
+class SQLAlchemyStorage(BaseStorage):
+    """FSM-хранилище в базе бота, переживающее перезапуск.
+
+    Чтение идет через кэш в памяти (TTLStore), изменения копятся в _dirty и пишутся
+    одной транзакцией в flush(), который вызывает FSMFlushMiddleware после каждого апдейта.
+    Так несколько set_state/update_data одного обработчика дают одну запись в БД, а с очередью
+    записи - одну операцию в общем пакете писателя.
+
+    Кэш не знает об изменениях, сделанных другими процессами (несколько реплик за балансировщиком),
+    поэтому запись в нем живет cache_ttl секунд с момента чтения из базы и чтением не продлевается.
+    При нескольких процессах cache_ttl=0 отключает кэш: состояние каждый раз читается из базы.
+    """
+
+    def __init__(self, session_pool: async_sessionmaker, cache_ttl: float, cache_max_size: int):
+        self.session_pool = session_pool
+        self.store: TTLStore[StorageKey, Record] = TTLStore(
+            "fsm", ttl=cache_ttl, max_size=cache_max_size
+        )
+        self._dirty: Dict[StorageKey, Record] = {}
+        self.reads = 0  # Обращений к БД за состоянием
+        self.writes = 0  # Транзакций записи
+
+    @staticmethod
+    def _db_key(key: StorageKey) -> str:
+        return ":".join(str(part) for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id or "", key.business_connection_id or "", key.destiny
+        ))
+
+    async def _get(self, key: StorageKey) -> Record:
+        record = self._dirty.get(key) or self.store.get(key)
+        if record is not None:
+            return record
+        async with self.session_pool() as session:
+            row = await orm_get_fsm_record(session, self._db_key(key))
+        self.reads += 1
+        record = (row.state, json.loads(row.data)) if row else (None, {})
+        self.store.set(key, record)
+        return record
+
+    def _put(self, key: StorageKey, record: Record) -> None:
+        self.store.set(key, record)
+        self._dirty[key] = record
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        _, data = await self._get(key)
+        self._put(key, (state.state if isinstance(state, State) else state, data))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._get(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        state, _ = await self._get(key)
+        self._put(key, (state, data.copy()))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._get(key)
+        return data.copy()
+
+    async def flush(self, key: Optional[StorageKey] = None) -> None:
+        """Записывает накопленные изменения ключа key (или все) одной транзакцией."""
+        keys = [key] if key is not None else list(self._dirty)
+        pending = {k: self._dirty[k] for k in keys if k in self._dirty}
+        if not pending:
+            return
+        records = {
+            self._db_key(k): (state, json.dumps(data, ensure_ascii=False) if state is not None or data else None)
+            for k, (state, data) in pending.items()
+        }
+        async with self.session_pool() as session:
+            saved = await run_write(session, orm_save_fsm_records, records)
+        self.writes += 1
+        if not saved:
+            logger.warning(f"Состояния FSM ({len(pending)}) не сохранены, повторим при следующей записи")
+            return
+        for k, record in pending.items():
+            # Пока шла запись, обработчик мог снова изменить состояние
+            if self._dirty.get(k) is record:
+                del self._dirty[k]
+
+    async def close(self) -> None:
+        await self.flush()
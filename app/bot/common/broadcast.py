@@ -0,0 +1,354 @@
+import asyncio
+import logging
+import os
+import socket
+from dataclasses import dataclass, field
+from datetime import timedelta
+from enum import Enum
+from time import monotonic
+from typing import Any, Awaitable, Callable, Dict, Iterable, List
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, TelegramNotFound,
+    TelegramRetryAfter, TelegramServerError
+)
+from aiogram.types import ReplyKeyboardRemove
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.bot.common.token_store import utcnow
+from app.bot.common.user_status import user_status
+from app.database.models import BroadcastJob
+from app.database.orm_query import (
+    orm_get_broadcast_job, orm_get_unfinished_broadcast_jobs, orm_acquire_broadcast_job, orm_claim_broadcast_chunk,
+    orm_mark_broadcast_chunk, orm_finish_broadcast_job, orm_mark_unreachable, orm_release_broadcast_job
+)
+from app.database.writer import run_write
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: ~30 сообщений в секунду на бота и 1 сообщение в секунду в один чат
+DEFAULT_RATE = 25.0
+MIN_RATE = 5.0
+MAX_RATE = 30.0
+PER_CHAT_INTERVAL = 1.0
+# Сколько получателей берется в работу и отмечается в БД за один раз
+BROADCAST_CHUNK_SIZE = 500
+# Аренда задачи рассылки продлевается на каждой порции: порция из 500 сообщений
+# даже на минимальной скорости отправляется быстрее. Задачу упавшего процесса
+# другой процесс подхватит, когда аренда истечет.
+BROADCAST_LEASE = timedelta(minutes=10)
+# Имя процесса в broadcast_job.claimed_by; после перезапуска в том же контейнере совпадает
+PROCESS_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class DeliveryFailure(str, Enum):
+    """Причина недоставки сообщения."""
+    FORBIDDEN = "forbidden"  # Пользователь заблокировал бота
+    CHAT_NOT_FOUND = "chat_not_found"  # Чат не существует
+    DEACTIVATED = "deactivated"  # Аккаунт удален
+    TRANSIENT = "transient"  # Временная ошибка, пользователя не исключаем
+
+
+def classify_failure(error: Exception) -> DeliveryFailure:
+    """Определяет причину недоставки по ошибке Telegram."""
+    description = str(error).lower()
+    if isinstance(error, TelegramForbiddenError):
+        if "deactivated" in description:
+            return DeliveryFailure.DEACTIVATED
+        return DeliveryFailure.FORBIDDEN
+    if isinstance(error, (TelegramBadRequest, TelegramNotFound)) and "chat not found" in description:
+        return DeliveryFailure.CHAT_NOT_FOUND
+    return DeliveryFailure.TRANSIENT
+
+
+class TokenBucket:
+    """Глобальный токен-бакет с изменяемой скоростью и общей паузой по retry_after."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def set_rate(self, rate: float) -> None:
+        """Меняет скорость пополнения, не теряя накопленные токены."""
+        self._refill(monotonic())
+        self.rate = rate
+        self.capacity = rate
+        self._tokens = min(self._tokens, self.capacity)
+
+    def pause(self, seconds: float) -> None:
+        """Останавливает выдачу токенов на указанное время (TelegramRetryAfter)."""
+        self._paused_until = max(self._paused_until, monotonic() + seconds)
+        self._tokens = 0
+
+    @property
+    def paused(self) -> bool:
+        """Идет пауза по retry_after."""
+        return monotonic() < self._paused_until
+
+    async def acquire(self) -> None:
+        """Ожидает, пока не появится свободный токен."""
+        async with self._lock:
+            while True:
+                now = monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+@dataclass
+class BroadcastResult:
+    """Итоги рассылки."""
+    delivered: List[int] = field(default_factory=list)
+    failed: Dict[int, Exception] = field(default_factory=dict)
+    retries: int = 0
+    elapsed: float = 0.0
+
+    def permanent_failures(self) -> Dict[int, str]:
+        """Возвращает получателей, которым писать бесполезно, с причиной."""
+        reasons = {user_id: classify_failure(error) for user_id, error in self.failed.items()}
+        return {user_id: reason.value for user_id, reason in reasons.items()
+                if reason is not DeliveryFailure.TRANSIENT}
+
+
+class BroadcastEngine:
+    """Движок рассылок: общий токен-бакет, пауза на чат, повторы и адаптация скорости по 429."""
+
+    def __init__(
+        self,
+        rate: float = DEFAULT_RATE,
+        min_rate: float = MIN_RATE,
+        max_rate: float = MAX_RATE,
+        concurrency: int = 30,
+        max_retries: int = 5,
+        per_chat_interval: float = PER_CHAT_INTERVAL,
+    ):
+        self.bucket = TokenBucket(rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.per_chat_interval = per_chat_interval
+        self._chat_next: Dict[int, float] = {}
+        self._success_streak = 0
+
+    def _on_success(self) -> None:
+        # Аддитивное увеличение: +1 сообщение/сек после секунды работы без 429
+        self._success_streak += 1
+        if self._success_streak >= self.bucket.rate and self.bucket.rate < self.max_rate:
+            self.bucket.set_rate(min(self.max_rate, self.bucket.rate + 1))
+            self._success_streak = 0
+
+    def _on_retry_after(self, retry_after: float) -> None:
+        # Мультипликативное уменьшение один раз на окно retry_after: отправки, которые были
+        # в полете одновременно, получают 429 пачкой, но это одна перегрузка, а не несколько
+        self._success_streak = 0
+        already_paused = self.bucket.paused
+        self.bucket.pause(retry_after)
+        if already_paused:
+            return
+        self.bucket.set_rate(max(self.min_rate, self.bucket.rate / 2))
+        logger.warning(f"Telegram попросил подождать {retry_after} с, скорость снижена до {self.bucket.rate:.1f}/с")
+
+    async def _wait_chat(self, chat_id: int) -> None:
+        delay = self._chat_next.get(chat_id, 0) - monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._chat_next[chat_id] = monotonic() + self.per_chat_interval
+
+    async def _deliver(self, chat_id: int, send: Callable[[int], Awaitable[Any]], result: BroadcastResult) -> None:
+        attempt = 0
+        while True:
+            await self._wait_chat(chat_id)
+            await self.bucket.acquire()
+            try:
+                await send(chat_id)
+            except TelegramRetryAfter as e:
+                self._on_retry_after(e.retry_after)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                if attempt >= self.max_retries:
+                    result.failed[chat_id] = e
+                    logger.warning(f"Не удалось отправить сообщение user_id={chat_id}: {e}")
+                    return
+                await asyncio.sleep(min(30, 2 ** attempt))
+            except Exception as e:
+                result.failed[chat_id] = e
+                logger.warning(f"Не удалось отправить сообщение user_id={chat_id}: {e}")
+                return
+            else:
+                self._on_success()
+                result.delivered.append(chat_id)
+                return
+            attempt += 1
+            result.retries += 1
+
+    async def broadcast(self, chat_ids: Iterable[int], send: Callable[[int], Awaitable[Any]],
+                        result: BroadcastResult = None) -> BroadcastResult:
+        """Отправляет сообщение каждому chat_id с помощью send и возвращает итоги.
+
+        Итоги копятся в result по мере отправки: если рассылку отменят, в нем останется то, что успело уйти.
+        """
+        result = result if result is not None else BroadcastResult()
+        started = monotonic()
+        queue: asyncio.Queue = asyncio.Queue()
+        for chat_id in chat_ids:
+            queue.put_nowait(chat_id)
+
+        async def worker() -> None:
+            while not queue.empty():
+                chat_id = queue.get_nowait()
+                await self._deliver(chat_id, send, result)
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(min(self.concurrency, queue.qsize()))))
+        finally:
+            for chat_id in result.delivered:
+                self._chat_next.pop(chat_id, None)
+            for chat_id in result.failed:
+                self._chat_next.pop(chat_id, None)
+        result.elapsed = monotonic() - started
+        logger.info(
+            f"Рассылка завершена: доставлено {len(result.delivered)}, ошибок {len(result.failed)}, "
+            f"повторов {result.retries}, за {result.elapsed:.1f} с"
+        )
+        return result
+
+
+# Общий движок на процесс: все рассылки делят один лимит Telegram
+broadcast_engine = BroadcastEngine()
+
+# Запущенные в процессе задачи рассылки (держим ссылки, чтобы задачи не собрал GC)
+running_jobs: Dict[int, asyncio.Task] = {}
+
+
+def make_sender(bot: Bot, job: BroadcastJob) -> Callable[[int], Awaitable[Any]]:
+    """Возвращает функцию отправки одному получателю для задачи рассылки."""
+    if job.kind == "forward":
+        return lambda user_id: bot.forward_message(
+            chat_id=user_id, from_chat_id=job.from_chat_id, message_id=job.message_id
+        )
+    return lambda user_id: bot.send_message(chat_id=user_id, text=job.text, reply_markup=ReplyKeyboardRemove())
+
+
+async def run_broadcast_job(bot: Bot, session_pool: async_sessionmaker, job_id: int,
+                            chunk_size: int = BROADCAST_CHUNK_SIZE, owner: str = PROCESS_OWNER) -> None:
+    """Выполняет задачу рассылки порциями, отмечая доставку после каждой порции.
+
+    После перезапуска продолжает с последней отметки: уже доставленные получатели
+    повторно не получают сообщение. Задачу ведет один процесс - тот, кто взял ее аренду.
+    """
+    async with session_pool() as session:
+        now = utcnow()
+        if not await run_write(session, orm_acquire_broadcast_job, job_id, owner, now, now + BROADCAST_LEASE):
+            logger.info(f"Рассылку id={job_id} ведет другой процесс")
+            return
+        job = await orm_get_broadcast_job(session, job_id)
+    if job is None or job.status != "running":
+        return
+    send = make_sender(bot, job)
+    sent, failed = job.sent, job.failed
+    logger.info(f"Рассылка id={job_id} запущена с user_id>{job.cursor}")
+
+    result = None
+    try:
+        while True:
+            async with session_pool() as session:
+                user_ids = await run_write(session, orm_claim_broadcast_chunk, job_id, chunk_size, owner,
+                                           utcnow() + BROADCAST_LEASE)
+            if user_ids is None:
+                logger.warning(f"Аренда рассылки id={job_id} истекла, задачу продолжает другой процесс")
+                return
+            if not user_ids:
+                break
+            result = BroadcastResult()
+            await broadcast_engine.broadcast(user_ids, send, result)
+            await _record_chunk(session_pool, job_id, result)
+            sent += len(result.delivered)
+            failed += len(result.failed)
+            result = None
+            logger.info(f"Рассылка id={job_id}: доставлено {sent}, ошибок {failed}, "
+                        f"скорость {broadcast_engine.bucket.rate:.1f}/с")
+    except asyncio.CancelledError:
+        # Остановка процесса: отмечаем уже отправленное и отдаем задачу, не дожидаясь истечения аренды.
+        # Неотправленные получатели порции остаются pending и достанутся следующему владельцу
+        if result is not None:
+            await _record_chunk(session_pool, job_id, result)
+        async with session_pool() as session:
+            await run_write(session, orm_release_broadcast_job, job_id, owner)
+        logger.info(f"Рассылка id={job_id} остановлена, аренда освобождена")
+        raise
+
+    async with session_pool() as session:
+        await run_write(session, orm_finish_broadcast_job, job_id, owner)
+    logger.info(f"Рассылка id={job_id} завершена: всего доставлено {sent}, ошибок {failed}")
+
+
+async def _record_chunk(session_pool: async_sessionmaker, job_id: int, result: BroadcastResult) -> None:
+    """Отмечает итоги порции и исключает из рассылок недоступных получателей."""
+    unreachable = result.permanent_failures()
+    async with session_pool() as session:
+        await run_write(session, orm_mark_broadcast_chunk, job_id, result.delivered, list(result.failed))
+        if unreachable:
+            await run_write(session, orm_mark_unreachable, unreachable)
+            # Следующий /start должен снять отметку недоступности в базе
+            user_status.forget(*unreachable)
+
+
+def spawn_broadcast_job(bot: Bot, session_pool: async_sessionmaker, job_id: int) -> asyncio.Task:
+    """Запускает задачу рассылки в фоне, если она еще не запущена в этом процессе."""
+    task = running_jobs.get(job_id)
+    if task is None or task.done():
+        task = asyncio.create_task(run_broadcast_job(bot, session_pool, job_id))
+        running_jobs[job_id] = task
+        task.add_done_callback(lambda t: _on_job_done(job_id, t))
+    return task
+
+
+def _on_job_done(job_id: int, task: asyncio.Task) -> None:
+    if running_jobs.get(job_id) is task:
+        del running_jobs[job_id]
+    if not task.cancelled() and task.exception():
+        logger.error(f"Рассылка id={job_id} прервана с ошибкой: {task.exception()}")
+
+
+async def stop_broadcast_jobs() -> None:
+    """Останавливает рассылки процесса при завершении работы, освобождая их аренду."""
+    tasks = [task for task in running_jobs.values() if not task.done()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def resume_broadcast_jobs(bot: Bot, session_pool: async_sessionmaker) -> List[int]:
+    """Возобновляет в фоне рассылки, прерванные перезапуском."""
+    async with session_pool() as session:
+        job_ids = await orm_get_unfinished_broadcast_jobs(session)
+    for job_id in job_ids:
+        spawn_broadcast_job(bot, session_pool, job_id)
+    if job_ids:
+        logger.info(f"Возобновлены рассылки: {job_ids}")
+    return job_ids
+
+
+async def resume_broadcast_jobs_periodically(bot: Bot, session_pool: async_sessionmaker,
+                                             interval: float = BROADCAST_LEASE.total_seconds()) -> None:
+    """Периодически подхватывает рассылки, чья аренда истекла (процесс, который их вел, упал)."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await resume_broadcast_jobs(bot, session_pool)
+        except Exception as e:
+            logger.error(f"Ошибка возобновления рассылок: {e}")
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.orm_query import Page, orm_get_all_categories, orm_get_all_themes, orm_get_all_materials
+
+logger = logging.getLogger(__name__)
+
+MATERIALS_PER_PAGE = 5
+
+
+class ThemeRecord(NamedTuple):
+    """Тема конкурса вместе с названием категории."""
+    id: int
+    title: str
+    technique: str
+    category_id: int
+    category_title: str
+
+
+class MaterialRecord(NamedTuple):
+    """Материал для участников."""
+    id: int
+    title: str
+    link: str
+
+
+class Catalog:
+    """Кэш справочников (категории, темы, материалы) на процесс.
+
+    Загружается целиком при первом обращении и хранит неизменяемые записи, не привязанные
+    к сессии. Сбрасывается явно через invalidate(), каждый сброс увеличивает version.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self._themes: Dict[int, ThemeRecord] = {}
+        self._themes_by_category: Dict[int, Tuple[ThemeRecord, ...]] = {}
+        self._materials: Dict[int, MaterialRecord] = {}
+        self._material_pages = 0
+
+    async def load(self, session: AsyncSession) -> None:
+        """Загружает справочники тремя запросами."""
+        version = self.version
+        categories = {row.id: row.title for row in await orm_get_all_categories(session)}
+        themes = [
+            ThemeRecord(row.id, row.title, row.technique, row.category_id, categories.get(row.category_id, ""))
+            for row in await orm_get_all_themes(session)
+        ]
+        materials = [MaterialRecord(row.id, row.title, row.link) for row in await orm_get_all_materials(session)]
+
+        themes_by_category: Dict[int, list] = {}
+        for theme in themes:
+            themes_by_category.setdefault(theme.category_id, []).append(theme)
+
+        self._themes = {theme.id: theme for theme in themes}
+        self._themes_by_category = {key: tuple(value) for key, value in themes_by_category.items()}
+        self._materials = {material.id: material for material in materials}
+        self._material_pages = (max(self._materials, default=0) + MATERIALS_PER_PAGE - 1) // MATERIALS_PER_PAGE
+        # Пустой справочник не кэшируем: возможно, он еще не заполнен или запрос не удался.
+        # Если во время загрузки кэш сбросили, данные могли устареть - загрузим еще раз
+        self._loaded = bool(themes or materials) and version == self.version
+        logger.info(f"Справочники загружены: {len(themes)} тем, {len(materials)} материалов, версия {self.version}")
+
+    async def ensure_loaded(self, session: AsyncSession) -> None:
+        if self._loaded:
+            return
+        async with self._lock:
+            if not self._loaded:
+                await self.load(session)
+
+    def invalidate(self) -> None:
+        """Сбрасывает кэш, следующее обращение загрузит справочники заново."""
+        self._loaded = False
+        self.version += 1
+        logger.info(f"Кэш справочников сброшен, версия {self.version}")
+
+    async def theme_page(self, session: AsyncSession, category_id: int) -> Page:
+        """Возвращает страницу тем одной категории; соседние страницы - соседние категории."""
+        await self.ensure_loaded(session)
+        return Page(
+            self._themes_by_category.get(category_id, ()), category_id,
+            has_prev=category_id - 1 in self._themes_by_category,
+            has_next=category_id + 1 in self._themes_by_category,
+        )
+
+    async def theme(self, session: AsyncSession, theme_id: int) -> Optional[ThemeRecord]:
+        """Возвращает тему по ID."""
+        await self.ensure_loaded(session)
+        return self._themes.get(theme_id)
+
+    async def materials_page(self, session: AsyncSession, page: int) -> Page:
+        """Возвращает материалы страницы page (ID с 1 + 5 * page по 5 * (page + 1))."""
+        await self.ensure_loaded(session)
+        first = 1 + MATERIALS_PER_PAGE * page
+        materials = (self._materials.get(material_id) for material_id in range(first, first + MATERIALS_PER_PAGE))
+        return Page(
+            tuple(material for material in materials if material), page,
+            has_prev=page > 0,
+            has_next=page + 1 < self._material_pages,
+        )
+
+
+# Общий кэш справочников на процесс
+catalog = Catalog()
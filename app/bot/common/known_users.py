@@ -0,0 +1,79 @@
+import logging
+import sys
+from array import array
+from bisect import bisect_left
+from typing import Set
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.orm_query import orm_iter_user_ids
+
+logger = logging.getLogger(__name__)
+
+
+class KnownUsersIndex:
+    """Компактный индекс известных user_id: отсортированный array('q') и бинарный поиск.
+
+    8 байт на пользователя вместо ~36 у списка int, проверка за O(log n).
+    В индексе пользователи, которые есть в user и не отмечены недоступными.
+    """
+
+    def __init__(self):
+        self._ids = array("q")
+        self._warming = False
+        self._removed_while_warming: Set[int] = set()
+        self.warmed = False
+
+    def __contains__(self, user_id: int) -> bool:
+        ids = self._ids
+        i = bisect_left(ids, user_id)
+        return i < len(ids) and ids[i] == user_id
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, user_id: int) -> None:
+        """Добавляет user_id, сохраняя порядок."""
+        ids = self._ids
+        i = bisect_left(ids, user_id)
+        if i == len(ids) or ids[i] != user_id:
+            ids.insert(i, user_id)
+        if self._warming:
+            self._removed_while_warming.discard(user_id)
+
+    def discard(self, user_id: int) -> None:
+        """Убирает user_id из индекса, если он там есть."""
+        ids = self._ids
+        i = bisect_left(ids, user_id)
+        if i < len(ids) and ids[i] == user_id:
+            del ids[i]
+        if self._warming:
+            self._removed_while_warming.add(user_id)
+
+    def memory_usage(self) -> int:
+        """Возвращает объем памяти индекса в байтах."""
+        return sys.getsizeof(self._ids)
+
+    async def warm(self, session: AsyncSession) -> None:
+        """Заполняет индекс одним потоковым проходом по таблице User."""
+        ids = array("q")
+        self._warming = True
+        try:
+            async for chunk in orm_iter_user_ids(session, reachable_only=True):
+                ids.extend(chunk)  # keyset-пагинация отдает user_id по возрастанию
+        finally:
+            self._warming = False
+            removed_meanwhile, self._removed_while_warming = self._removed_while_warming, set()
+        added_meanwhile = self._ids
+        self._ids = ids
+        # Пока шел проход, /start мог завести пользователей, а рассылка - отметить недоступных
+        for user_id in added_meanwhile:
+            self.add(user_id)
+        for user_id in removed_meanwhile:
+            self.discard(user_id)
+        self.warmed = True
+        logger.info(f"Индекс пользователей прогрет: {len(self)} user_id, {self.memory_usage() / 1024:.1f} КБ")
+
+
+# Общий индекс на процесс, прогревается при запуске и пополняется при /start
+known_users = KnownUsersIndex()
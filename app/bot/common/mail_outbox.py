@@ -0,0 +1,155 @@
+import asyncio
+import logging
+from datetime import timedelta
+from email.message import Message
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+import aiosmtplib
+from aiogram import Bot
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.bot.common.token_store import utcnow
+from app.database.models import OutboxEmail
+from app.database.orm_query import orm_enqueue_email, orm_claim_due_email, orm_finish_email, orm_get_email_status, \
+    orm_scrub_finished_emails
+from app.database.writer import run_write
+
+logger = logging.getLogger(__name__)
+
+# Отказ сервера принять адрес: повтор не поможет
+PERMANENT_ERRORS = (aiosmtplib.SMTPRecipientsRefused, aiosmtplib.SMTPRecipientRefused, aiosmtplib.SMTPSenderRefused)
+
+
+class MailOutbox:
+    """Очередь исходящих писем в базе и пул воркеров, который ее разбирает.
+
+    Обработчик вызывает enqueue() и сразу отвечает пользователю. Воркеры берут письма
+    из таблицы email_outbox, одновременно отправляют не больше per_domain писем на один
+    домен и повторяют неудачные попытки с экспоненциальной задержкой до max_attempts раз.
+    По итогу вызывается on_done(bot, email, delivered), чтобы сообщить пользователю.
+    """
+
+    def __init__(self, session_pool: async_sessionmaker, send: Callable[[Message], Awaitable[None]], sender: str,
+                 workers: int = 4, per_domain: int = 2, max_attempts: int = 6, base_delay: float = 10,
+                 max_delay: float = 1800, lease: float = 300, poll_interval: float = 5,
+                 on_done: Optional[Callable[[Bot, OutboxEmail, bool], Awaitable[None]]] = None):
+        self.session_pool = session_pool
+        self.send = send
+        self.sender = sender
+        self.workers = workers
+        self.per_domain = per_domain
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.on_done = on_done
+        self._wakeup = asyncio.Event()
+        self._claim_lock = asyncio.Lock()
+        self._active: Dict[str, int] = {}  # Сколько писем сейчас отправляется на домен
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    async def enqueue(self, user_id: Optional[int], recipient: str, subject: str, body: str) -> int:
+        """Ставит письмо в очередь и возвращает его ID для проверки статуса."""
+        async with self.session_pool() as session:
+            email_id = await run_write(session, orm_enqueue_email, user_id, recipient, subject, body, utcnow())
+        if email_id is None:
+            raise RuntimeError(f"Не удалось поставить письмо на {recipient} в очередь")
+        self._wakeup.set()
+        return email_id
+
+    async def status(self, email_id: int) -> Optional[Row]:
+        """Статус письма: status (pending / sending / sent / failed), attempts, last_error, sent_at."""
+        async with self.session_pool() as session:
+            return await orm_get_email_status(session, email_id)
+
+    def _busy_domains(self) -> Set[str]:
+        return {domain for domain, count in self._active.items() if count >= self.per_domain}
+
+    async def _claim(self) -> Optional[OutboxEmail]:
+        async with self._claim_lock:
+            now = utcnow()
+            async with self.session_pool() as session:
+                email = await run_write(
+                    session, orm_claim_due_email, now, now + timedelta(seconds=self.lease), tuple(self._busy_domains())
+                )
+            if email is not None:
+                self._active[email.domain] = self._active.get(email.domain, 0) + 1
+            return email
+
+    def _build_message(self, email: OutboxEmail) -> Message:
+        msg = MIMEMultipart()
+        msg['From'] = self.sender
+        msg['To'] = email.recipient
+        msg['Subject'] = email.subject
+        msg.attach(MIMEText(email.body, 'plain'))
+        return msg
+
+    async def _deliver(self, bot: Bot, email: OutboxEmail) -> None:
+        attempts = email.attempts + 1
+        try:
+            await self.send(self._build_message(email))
+        except Exception as e:
+            if isinstance(e, PERMANENT_ERRORS) or attempts >= self.max_attempts:
+                self.failed += 1
+                logger.error(f"Письмо id={email.id} на {email.recipient} не отправлено после {attempts} попыток: {e}")
+                async with self.session_pool() as session:
+                    await run_write(session, orm_finish_email, email.id, "failed", attempts, str(e))
+                delivered = False
+            else:
+                self.retried += 1
+                delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+                logger.warning(f"Письмо id={email.id} на {email.recipient}: попытка {attempts} неудачна ({e}), повтор через {delay} с")
+                async with self.session_pool() as session:
+                    await run_write(session, orm_finish_email, email.id, "pending", attempts, str(e),
+                                    next_attempt_at=utcnow() + timedelta(seconds=delay))
+                return
+        else:
+            self.sent += 1
+            logger.info(f"Письмо id={email.id} отправлено на {email.recipient} с попытки {attempts}")
+            async with self.session_pool() as session:
+                await run_write(session, orm_finish_email, email.id, "sent", attempts)
+            delivered = True
+        if self.on_done is not None:
+            try:
+                await self.on_done(bot, email, delivered)
+            except Exception as e:
+                logger.error(f"Ошибка уведомления о письме id={email.id}: {e}")
+
+    async def _worker(self, bot: Bot) -> None:
+        while True:
+            # Сбрасываем до выборки, чтобы не пропустить письмо, поставленное во время нее
+            self._wakeup.clear()
+            try:
+                email = await self._claim()
+            except Exception as e:
+                logger.error(f"Ошибка выборки писем из очереди: {e}")
+                email = None
+            if email is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._deliver(bot, email)
+            finally:
+                self._active[email.domain] -= 1
+                if not self._active[email.domain]:
+                    del self._active[email.domain]
+                # Освободился слот домена - другие воркеры могут взять его письма
+                self._wakeup.set()
+
+    async def run(self, bot: Bot) -> None:
+        """Запускает воркеры и работает до отмены."""
+        # Письма, завершенные до того, как текст стал стираться при завершении
+        async with self.session_pool() as session:
+            scrubbed = await run_write(session, orm_scrub_finished_emails)
+        if scrubbed:
+            logger.info(f"Стерт текст {scrubbed} отправленных писем")
+        await asyncio.gather(*(self._worker(bot) for _ in range(self.workers)))
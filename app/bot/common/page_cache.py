@@ -0,0 +1,65 @@
+from time import monotonic
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from aiogram.types import InlineKeyboardMarkup
+
+from app.bot.common.catalog import catalog
+from config import settings
+
+
+class RenderedPage(NamedTuple):
+    """Готовая страница: текст и клавиатура."""
+    text: str
+    reply_markup: Optional[InlineKeyboardMarkup]
+
+
+class PageCache:
+    """Кэш готовых страниц пагинации по ключу (view, page, settings.prod).
+
+    Страницы не зависят от пользователя, поэтому рендерятся один раз на процесс.
+    Кэш очищается вместе со справочниками (по смене catalog.version) или явно через invalidate().
+    Новости добавляет канал, а invalidate() видит только процесс, получивший пост,
+    поэтому страницы из view_ttl (новости) живут ограниченное время.
+    """
+
+    def __init__(self, view_ttl: Dict[str, float] = None):
+        self.view_ttl = view_ttl or {}
+        self._pages: Dict[Tuple[str, int, bool], Tuple[RenderedPage, float]] = {}  # (страница, когда устаревает)
+        self._catalog_version = catalog.version
+
+    def _sync_catalog_version(self) -> None:
+        if self._catalog_version != catalog.version:
+            self._pages.clear()
+            self._catalog_version = catalog.version
+
+    def get(self, view: str, page: int) -> Optional[RenderedPage]:
+        self._sync_catalog_version()
+        key = (view, page, settings.prod)
+        item = self._pages.get(key)
+        if item is None:
+            return None
+        rendered, expires_at = item
+        if expires_at <= monotonic():
+            del self._pages[key]
+            return None
+        return rendered
+
+    def put(self, view: str, page: int, rendered: RenderedPage, catalog_version: int) -> None:
+        """Сохраняет страницу, если справочники не сбросили, пока она рендерилась."""
+        self._sync_catalog_version()
+        if catalog_version == self._catalog_version:
+            ttl = self.view_ttl.get(view)
+            expires_at = monotonic() + ttl if ttl is not None else float("inf")
+            self._pages[(view, page, settings.prod)] = (rendered, expires_at)
+
+    def invalidate(self, view: str = None) -> None:
+        """Удаляет страницы одного представления или все страницы."""
+        if view is None:
+            self._pages.clear()
+            return
+        for key in [key for key in self._pages if key[0] == view]:
+            del self._pages[key]
+
+
+# Общий кэш страниц на процесс
+page_cache = PageCache(view_ttl={"news": settings.news_page_ttl})
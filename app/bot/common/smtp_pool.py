@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from email.message import Message
+from time import monotonic
+from typing import AsyncIterator, List, Optional, Tuple
+
+import aiosmtplib
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых соединение считается потерянным и письмо можно отправить заново по новому
+CONNECTION_ERRORS = (aiosmtplib.SMTPServerDisconnected, aiosmtplib.SMTPConnectError, aiosmtplib.SMTPTimeoutError, OSError)
+
+
+class SMTPPool:
+    """Пул долгоживущих авторизованных SMTP-соединений.
+
+    Соединение открывается (connect + STARTTLS + login) один раз и переиспользуется.
+    Простоявшее дольше idle_timeout закрывается, перед повторным использованием после
+    health_check_interval простоя проверяется командой NOOP. Потерянное соединение
+    переоткрывается, письмо отправляется повторно один раз.
+    """
+
+    def __init__(self, hostname: str, port: int, username: Optional[str] = None, password: Optional[str] = None,
+                 size: int = 2, idle_timeout: float = 60, health_check_interval: float = 10,
+                 use_tls: bool = False, start_tls: bool = True, timeout: float = 30):
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.use_tls = use_tls
+        self.start_tls = start_tls
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(size)
+        self._idle: List[Tuple[aiosmtplib.SMTP, float]] = []  # (соединение, когда освободилось)
+        self.connects = 0  # Открыто соединений
+        self.reuses = 0  # Писем по уже открытому соединению
+        self.reconnects = 0  # Переоткрытий после потери соединения
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        client = aiosmtplib.SMTP(
+            hostname=self.hostname,
+            port=self.port,
+            use_tls=self.use_tls,
+            start_tls=self.start_tls,
+            timeout=self.timeout
+        )
+        await client.connect()
+        if self.username:
+            try:
+                await client.login(self.username, self.password)
+            except BaseException:
+                # Иначе при каждой повторной попытке оставалось бы открытое соединение
+                client.close()
+                raise
+        self.connects += 1
+        logger.info(f"Открыто SMTP-соединение с {self.hostname}:{self.port}, всего открыто {self.connects}")
+        return client
+
+    @staticmethod
+    async def _close(client: aiosmtplib.SMTP) -> None:
+        try:
+            if client.is_connected:
+                await client.quit()
+        except Exception:
+            client.close()
+
+    async def _take(self) -> aiosmtplib.SMTP:
+        """Возвращает живое соединение из простаивающих или открывает новое."""
+        while self._idle:
+            client, released_at = self._idle.pop()
+            idle_for = monotonic() - released_at
+            if idle_for > self.idle_timeout or not client.is_connected:
+                await self._close(client)
+                continue
+            if idle_for > self.health_check_interval:
+                try:
+                    await client.noop()
+                except (aiosmtplib.SMTPException, OSError):
+                    await self._close(client)
+                    continue
+            self.reuses += 1
+            return client
+        return await self._connect()
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[aiosmtplib.SMTP]:
+        """Выдает соединение на время отправки. Соединение с ошибкой в пул не возвращается."""
+        async with self._semaphore:
+            client = await self._take()
+            try:
+                yield client
+            except BaseException:
+                await self._close(client)
+                raise
+            self._idle.append((client, monotonic()))
+
+    async def send_message(self, message: Message) -> None:
+        try:
+            async with self.connection() as client:
+                await client.send_message(message)
+        except CONNECTION_ERRORS as e:
+            self.reconnects += 1
+            logger.warning(f"SMTP-соединение потеряно ({e}), отправляем письмо заново")
+            async with self.connection() as client:
+                await client.send_message(message)
+
+    async def close(self) -> None:
+        """Закрывает все простаивающие соединения."""
+        idle, self._idle = self._idle, []
+        for client, _ in idle:
+            await self._close(client)
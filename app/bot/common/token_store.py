@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import secrets
+from abc import ABC, abstractmethod
+from datetime import timedelta
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.bot.common.ttl_store import TTLStore
+from app.database.models import utcnow
+from app.database.orm_query import orm_put_verification_token, orm_consume_verification_token, \
+    orm_purge_verification_tokens
+from app.database.writer import run_write
+
+logger = logging.getLogger(__name__)
+
+
+class TokenStore(ABC):
+    """Хранилище кодов подтверждения почты: у пользователя один действующий код на ttl секунд."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+
+    @abstractmethod
+    async def put(self, user_id: int, token: str) -> None:
+        """Сохраняет код пользователя, предыдущий код перестает действовать."""
+
+    @abstractmethod
+    async def consume(self, user_id: int, code: str) -> bool:
+        """Атомарно проверяет код и удаляет его при совпадении."""
+
+    @abstractmethod
+    async def purge_expired(self) -> int:
+        """Удаляет истекшие коды и возвращает их число."""
+
+
+class MemoryTokenStore(TokenStore):
+    """Коды в памяти процесса. Подходит, пока бот работает одним процессом."""
+
+    def __init__(self, ttl: float, max_size: int):
+        super().__init__(ttl)
+        self.store: TTLStore[int, str] = TTLStore("verification_tokens", ttl=ttl, max_size=max_size)
+
+    async def put(self, user_id: int, token: str) -> None:
+        self.store.set(user_id, token)
+
+    async def consume(self, user_id: int, code: str) -> bool:
+        token = self.store.get(user_id)
+        # compare_digest не принимает str с не-ASCII символами, а ответ может быть любым текстом
+        if token is None or not secrets.compare_digest(token.encode(), code.encode()):
+            return False
+        self.store.pop(user_id)
+        return True
+
+    async def purge_expired(self) -> int:
+        return self.store.sweep()
+
+
+class DBTokenStore(TokenStore):
+    """Коды в базе бота: код, отправленный одним процессом, проверит любой другой и после перезапуска."""
+
+    def __init__(self, session_pool: async_sessionmaker, ttl: float):
+        super().__init__(ttl)
+        self.session_pool = session_pool
+
+    async def put(self, user_id: int, token: str) -> None:
+        async with self.session_pool() as session:
+            saved = await run_write(session, orm_put_verification_token, user_id, token,
+                                    utcnow() + timedelta(seconds=self.ttl))
+        if not saved:
+            raise RuntimeError(f"Не удалось сохранить код подтверждения user_id={user_id}")
+
+    async def consume(self, user_id: int, code: str) -> bool:
+        async with self.session_pool() as session:
+            return await run_write(session, orm_consume_verification_token, user_id, code, utcnow())
+
+    async def purge_expired(self) -> int:
+        async with self.session_pool() as session:
+            return await run_write(session, orm_purge_verification_tokens, utcnow())
+
+
+async def purge_tokens_periodically(store: TokenStore, interval: float = 60) -> None:
+    """Раз в interval секунд удаляет истекшие коды подтверждения."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            removed = await store.purge_expired()
+            if removed:
+                logger.debug(f"Удалено {removed} истекших кодов подтверждения")
+        except Exception as e:
+            logger.error(f"Ошибка очистки кодов подтверждения: {e}")
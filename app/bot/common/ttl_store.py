@@ -0,0 +1,146 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Dict, Generic, Hashable, Iterable, Optional, Tuple, TypeVar
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+logger = logging.getLogger(__name__)
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TTLStore(Generic[K, V]):
+    """Ограниченное хранилище в памяти: записи живут ttl секунд, сверх max_size вытесняются самые давние.
+
+    Просроченные записи удаляются при обращении к ним и фоновым sweep() (см. sweep_periodically),
+    поэтому память не растет за счет пользователей, которые больше не вернулись.
+    При refresh_on_get чтение продлевает жизнь записи (скользящий TTL).
+    """
+
+    def __init__(self, name: str, ttl: float, max_size: int, refresh_on_get: bool = False):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self.refresh_on_get = refresh_on_get
+        self._items: "OrderedDict[K, Tuple[float, V]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # Вытеснено из-за max_size
+        self.expirations = 0  # Удалено по истечении ttl
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: K) -> bool:
+        return self._lookup(key) is not None
+
+    def _lookup(self, key: K) -> Optional[Tuple[float, V]]:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        if item[0] <= monotonic():
+            del self._items[key]
+            self.expirations += 1
+            return None
+        return item
+
+    def get(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        item = self._lookup(key)
+        if item is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        if self.refresh_on_get:
+            item = (monotonic() + self.ttl, item[1])
+            self._items[key] = item
+        self._items.move_to_end(key)
+        return item[1]
+
+    def set(self, key: K, value: V, ttl: Optional[float] = None) -> None:
+        self._items[key] = (monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        item = self._lookup(key)
+        if item is None:
+            return default
+        del self._items[key]
+        return item[1]
+
+    def sweep(self) -> int:
+        """Удаляет все просроченные записи и возвращает их число."""
+        now = monotonic()
+        expired = [key for key, (expires_at, _) in self._items.items() if expires_at <= now]
+        for key in expired:
+            del self._items[key]
+        self.expirations += len(expired)
+        return len(expired)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._items),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+async def sweep_periodically(stores: Iterable[TTLStore], interval: float = 60) -> None:
+    """Раз в interval секунд чистит просроченные записи во всех хранилищах."""
+    stores = list(stores)
+    while True:
+        await asyncio.sleep(interval)
+        for store in stores:
+            try:
+                removed = store.sweep()
+                if removed:
+                    logger.debug(f"Хранилище {store.name}: удалено {removed} просроченных записей, {store.stats()}")
+            except Exception as e:
+                logger.error(f"Ошибка очистки хранилища {store.name}: {e}")
+
+
+class BoundedMemoryStorage(BaseStorage):
+    """FSM-хранилище в памяти поверх TTLStore.
+
+    В отличие от MemoryStorage не создает запись при чтении, удаляет пустые записи
+    и забывает состояние пользователя, который не писал боту дольше ttl.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.store: TTLStore[StorageKey, Tuple[Optional[str], Dict[str, Any]]] = TTLStore(
+            "fsm", ttl=ttl, max_size=max_size, refresh_on_get=True
+        )
+
+    def _save(self, key: StorageKey, state: Optional[str], data: Dict[str, Any]) -> None:
+        if state is None and not data:
+            self.store.pop(key)
+        else:
+            self.store.set(key, (state, data))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        _, data = self.store.get(key, (None, {}))
+        self._save(key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = self.store.get(key, (None, {}))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        state, _ = self.store.get(key, (None, {}))
+        self._save(key, state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = self.store.get(key, (None, {}))
+        return data.copy()
+
+    async def close(self) -> None:
+        pass
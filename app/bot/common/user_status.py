@@ -0,0 +1,61 @@
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.bot.common.known_users import KnownUsersIndex, known_users
+from app.bot.common.ttl_store import TTLStore
+from app.database.orm_query import orm_ensure_user, orm_get_user_status
+from app.database.writer import run_write
+from config import settings
+
+# Признак "пользователь есть, но не зарегистрирован" (ФИО в кэше нет)
+NOT_REGISTERED = ""
+
+
+class UserStatusCache:
+    """Кэш статуса пользователя для /start: ФИО из анкеты или признак, что анкеты нет.
+
+    Запись означает, что пользователь есть в user и не отмечен недоступным. Сбрасывается
+    при регистрации, изменении анкеты и отметке недоступности. Кэш у каждого процесса свой,
+    поэтому устаревание в других процессах ограничено ttl.
+
+    Перед кэшем стоит индекс известных пользователей (прогревается при запуске): при промахе
+    кэша известный пользователь читается одним SELECT, а upsert через запись нужен только новым
+    и вернувшимся недоступным пользователям.
+    """
+
+    def __init__(self, ttl: float, max_size: int, index: KnownUsersIndex):
+        self.store: TTLStore[int, str] = TTLStore("user_status", ttl=ttl, max_size=max_size)
+        self.index = index
+
+    async def registration_name(self, session: AsyncSession, user_id: int, nickname: str) -> Optional[str]:
+        """Возвращает ФИО зарегистрированного пользователя или None, при промахе заводит пользователя в базе."""
+        name = self.store.get(user_id)
+        if name is None:
+            name = await self._load(session, user_id, nickname)
+            self.store.set(user_id, name)
+        return name or None
+
+    async def _load(self, session: AsyncSession, user_id: int, nickname: str) -> str:
+        if user_id in self.index:
+            status = await orm_get_user_status(session, user_id)
+            # Другой процесс мог отметить пользователя недоступным: тогда отметку снимет upsert
+            if status is not None and not status.unreachable:
+                return status.name or NOT_REGISTERED
+        name = await run_write(session, orm_ensure_user, user_id, nickname) or NOT_REGISTERED
+        self.index.add(user_id)
+        return name
+
+    def invalidate(self, *user_ids: int) -> None:
+        for user_id in user_ids:
+            self.store.pop(user_id)
+
+    def forget(self, *user_ids: int) -> None:
+        """Сбрасывает статус и убирает из индекса: следующий /start пройдет через upsert (отмечены недоступными)."""
+        self.invalidate(*user_ids)
+        for user_id in user_ids:
+            self.index.discard(user_id)
+
+
+# Общий кэш статусов на процесс
+user_status = UserStatusCache(ttl=settings.user_status_ttl, max_size=settings.user_status_max_size, index=known_users)
@@ -1,64 +1,85 @@
 import secrets
 import logging
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from time import time
-from typing import Dict, Tuple
+from typing import Optional
 
-import aiosmtplib
+from aiogram import Bot
+
+from app.bot.common.mail_outbox import MailOutbox
+from app.bot.common.smtp_pool import SMTPPool
+from app.bot.common.token_store import TokenStore, DBTokenStore, MemoryTokenStore
+from app.database.engine import session_maker
+from app.database.models import OutboxEmail
 from config import settings
 
 logger = logging.getLogger(__name__)
-users_token: Dict[int, Tuple[str, float]] = {}
 TOKEN_TIMEOUT = 600 # 10 минут
+TOKENS_MAX_SIZE = 10_000  # Одновременно ожидающих подтверждения адресов (для хранения в памяти)
+
+# Коды подтверждения: в базе видны всем процессам бота и переживают перезапуск
+if settings.verification_token_store == "db":
+    token_store: TokenStore = DBTokenStore(session_maker, ttl=TOKEN_TIMEOUT)
+else:
+    token_store = MemoryTokenStore(ttl=TOKEN_TIMEOUT, max_size=TOKENS_MAX_SIZE)
+
+# Соединения с почтовым сервером переиспользуются между письмами
+smtp_pool = SMTPPool(
+    hostname=settings.smtp_server,
+    port=settings.port,
+    username=settings.sender_email,
+    password=settings.sender_password,
+    size=settings.smtp_pool_size,
+    idle_timeout=settings.smtp_idle_timeout
+)
 
 def generate_verification_token() -> str:
     """Генерирует безопасный токен для верификации."""
     return secrets.token_urlsafe(8)
 
-async def send_verification_mail(mail: str, token: str) -> None:
-    """Отправляет письмо с кодом верификации."""
-    body = f'Пожалуйста, подтвердите ваш email, введя этот код в Телеграм-боте: {token}'
-    msg = MIMEMultipart()
-    msg['From'] = settings.sender_email
-    msg['To'] = mail
-    msg['Subject'] = 'Подтверждение email'
-    msg.attach(MIMEText(body, 'plain'))
+async def notify_verification_mail(bot: Bot, email: OutboxEmail, delivered: bool) -> None:
+    """Сообщает пользователю, ушло ли письмо с кодом."""
+    if email.user_id is None:
+        return
+    if delivered:
+        await bot.send_message(email.user_id, f"Письмо с кодом подтверждения отправлено на {email.recipient}")
+    else:
+        await bot.send_message(
+            email.user_id,
+            f"Не удалось отправить письмо на {email.recipient}. Проверьте адрес и начните заново командой /start"
+        )
+
+# Письма отправляются фоновыми воркерами из очереди в базе, обработчики их не ждут
+mail_outbox = MailOutbox(
+    session_maker,
+    send=smtp_pool.send_message,
+    sender=settings.sender_email,
+    workers=settings.mail_workers,
+    per_domain=settings.mail_per_domain,
+    max_attempts=settings.mail_max_attempts,
+    on_done=notify_verification_mail
+)
 
+async def send_verification_mail(mail: str, token: str, user_id: Optional[int] = None) -> int:
+    """Ставит письмо с кодом верификации в очередь и возвращает ID письма."""
+    body = f'Пожалуйста, подтвердите ваш email, введя этот код в Телеграм-боте: {token}'
     try:
-        smtp_client = aiosmtplib.SMTP(
-            hostname=settings.smtp_server,
-            port=settings.port,
-            use_tls=False,
-            start_tls=True
-        )
-        await smtp_client.connect()
-        await smtp_client.login(settings.sender_email, settings.sender_password)
-        await smtp_client.send_message(msg)
-        logger.info(f"Письмо с токеном {token} отправлено на {mail}")
+        email_id = await mail_outbox.enqueue(user_id, mail, 'Подтверждение email', body)
+        logger.info(f"Письмо с кодом для {mail} поставлено в очередь, id={email_id}")
+        return email_id
     except Exception as e:
-        logger.error(f"Ошибка отправки письма на {mail}: {e}")
+        logger.error(f"Ошибка постановки письма на {mail} в очередь: {e}")
         raise  # Пробрасываем исключение для обработки в вызывающем коде
-    finally:
-        await smtp_client.quit()
 
-async def start_verify_mail(mail: str, user_id: int) -> None:
-    """Запускает процесс верификации email."""
+async def start_verify_mail(mail: str, user_id: int) -> int:
+    """Запускает процесс верификации email и возвращает ID письма в очереди."""
     token = generate_verification_token()
-    users_token[user_id] = (token, time())
-    await send_verification_mail(mail, token)
+    await token_store.put(user_id, token)
+    email_id = await send_verification_mail(mail, token, user_id)
     logger.debug(f"Токен для user_id={user_id}: {token}")
+    return email_id
 
-def check_verify_code(code: str, user_id: int) -> bool:
-    if user_id in users_token:
-        token, timestamp = users_token[user_id]
-        if time() - timestamp > TOKEN_TIMEOUT:
-            del users_token[user_id]
-            logger.warning(f"Токен для user_id={user_id} истек")
-            return False
-        if token == code:
-            del users_token[user_id]
-            logger.info(f"Код верификации для user_id={user_id} подтвержден")
-            return True
+async def check_verify_code(code: str, user_id: int) -> bool:
+    if await token_store.consume(user_id, code.strip()):
+        logger.info(f"Код верификации для user_id={user_id} подтвержден")
+        return True
     logger.warning(f"Неверный код или токен истек для user_id={user_id}")
     return False
\ No newline at end of file
@@ -1,47 +1,53 @@
-from mailbox import Message
-
 from aiogram import Router
+from aiogram.types import Message
 
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
-from app.database.orm_query import orm_add_news, orm_edit_news_by_id, orm_get_all_user
+from app.bot.common.broadcast import spawn_broadcast_job
+from app.bot.common.page_cache import page_cache
+from app.database.orm_query import orm_add_news, orm_edit_news_by_id, orm_create_broadcast_job
+from app.database.writer import run_write
 
 news_channel_router = Router()
 
 
 @news_channel_router.channel_post()
-async def channel_post_handler(post: Message, session: AsyncSession):
+async def channel_post_handler(post: Message, session: AsyncSession, session_pool: async_sessionmaker):
     if post.photo:
         if post.caption:
-            await orm_add_news(session=session, post_id=post.message_id,
-                               text=post.caption,
-                               photo=post.photo[-1].file_id)
+            await run_write(session, orm_add_news, post_id=post.message_id,
+                            text=post.caption,
+                            photo=post.photo[-1].file_id)
             if "#Важное" in post.caption:
-                all_users = await orm_get_all_user(session)
-                for user in all_users:
-                    await post.bot.forward_message(chat_id=user, from_chat_id=post.chat.id, message_id=post.message_id)
+                job = await run_write(session, orm_create_broadcast_job, kind="forward",
+                                      from_chat_id=post.chat.id, message_id=post.message_id)
+                if job:
+                    # Рассылка идет в фоне, обработчик не держит сессию и апдейт
+                    spawn_broadcast_job(post.bot, session_pool, job.id)
         else:
-            await orm_add_news(session=session, post_id=post.message_id,
-                               text="Без текста",
-                               photo=post.photo[-1].file_id)
+            await run_write(session, orm_add_news, post_id=post.message_id,
+                            text="Без текста",
+                            photo=post.photo[-1].file_id)
     else:
-        await orm_add_news(session=session, post_id=post.message_id ,
-                           text=post.text,
-                           photo="Без фото")
+        await run_write(session, orm_add_news, post_id=post.message_id ,
+                        text=post.text,
+                        photo="Без фото")
+    page_cache.invalidate("news")
 
 @news_channel_router.edited_channel_post()
 async def edited_channel_post_handler(post: Message, session: AsyncSession):
 
     if post.photo:
         if post.caption:
-            await orm_edit_news_by_id(session=session, post_id=post.message_id,
-                                      text=post.caption,
-                                      photo=post.photo[-1].file_id)
+            await run_write(session, orm_edit_news_by_id, post_id=post.message_id,
+                            text=post.caption,
+                            photo=post.photo[-1].file_id)
         else:
-            await orm_edit_news_by_id(session=session, post_id=post.message_id,
-                               text="Без текста",
-                               photo=post.photo[-1].file_id)
+            await run_write(session, orm_edit_news_by_id, post_id=post.message_id,
+                            text="Без текста",
+                            photo=post.photo[-1].file_id)
     else:
-        await orm_edit_news_by_id(session=session, post_id=post.message_id ,
-                           text=post.text,
-                           photo="Без фото")
+        await run_write(session, orm_edit_news_by_id, post_id=post.message_id ,
+                        text=post.text,
+                        photo="Без фото")
+    page_cache.invalidate("news")
@@ -1,3 +1,5 @@
+import logging
+
 from aiogram import Router, F
 from aiogram.filters import StateFilter
 from aiogram.fsm.context import FSMContext
@@ -6,10 +8,14 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.bot.FSM.FSM_user_private import User_MainStates, EditProfile
 from app.bot.common.validation import validate_fio, validate_phone_number, validate_email_format
+from app.bot.common.user_status import user_status
 from app.bot.common.verif_mail import start_verify_mail, check_verify_code
 
 from app.kbds.reply import get_keyboard, menu_kb
 from app.database.orm_query import orm_Edit_user_profile, orm_Get_info_user
+from app.database.writer import run_write
+
+logger = logging.getLogger(__name__)
 
 user_view_profile_router = Router()
 
@@ -181,11 +187,12 @@ async def verify_mail(message: Message, state: FSMContext, session: AsyncSession
         await message.answer(text='Хорошо. Возвращаю вас в меню вашего профиля', reply_markup=reply_markup)
         await state.set_data({})
         return
-    if check_verify_code(message.text, message.from_user.id):
+    if await check_verify_code(message.text, message.from_user.id):
         data = await state.get_data()
         print("После подвтверждения", data)
         await message.answer(text="Подтверждение почты успешно пройдено")
-        await orm_Edit_user_profile(session=session, user_id=message.from_user.id, data=data)
+        await run_write(session, orm_Edit_user_profile, user_id=message.from_user.id, data=data)
+        user_status.invalidate(message.from_user.id)
 
         data = await orm_Get_info_user(session, message.from_user.id)
         await message.answer(text="Данные успешно изменены.\nПеревожу Вас в меню Вашего профиля...")
@@ -221,17 +228,19 @@ async def confirm_changes(message: Message, state: FSMContext, session: AsyncSes
                 await start_verify_mail(data['edit_mail'], message.from_user.id)
                 await state.set_state(EditProfile.verify_mail)
             except Exception as e:
-                pass
-            finally:
-                reply_markup = get_keyboard(
-                    "Я передумал",
-                    placeholder="Выберите:",
-                    sizes=(2,),
-                )
-                await message.answer(text="На вашу почту был отправлен код подтверждения. Пожалуйста введите код", reply_markup=reply_markup)
+                logger.error(f"Ошибка отправки кода на почту user_id={message.from_user.id}: {e}")
+                await message.answer("Ошибка при отправке кода. Попробуйте позже")
+                return
+            reply_markup = get_keyboard(
+                "Я передумал",
+                placeholder="Выберите:",
+                sizes=(2,),
+            )
+            await message.answer(text="Отправляем на вашу почту код подтверждения, я сообщу, когда письмо уйдет. Пожалуйста введите код из письма", reply_markup=reply_markup)
         else:
             try:
-                await orm_Edit_user_profile(session=session, user_id=message.from_user.id, data=data)
+                await run_write(session, orm_Edit_user_profile, user_id=message.from_user.id, data=data)
+                user_status.invalidate(message.from_user.id)
 
                 data = await orm_Get_info_user(session, message.from_user.id)
                 await message.answer(text="Данные успешно изменены.\nПеревожу Вас в меню Вашего профиля...")
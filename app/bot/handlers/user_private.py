@@ -1,7 +1,5 @@
-import asyncio
 import logging
-from time import time
-from typing import Dict, Union, Callable, Awaitable
+from typing import Dict, Union, Callable, Awaitable, Optional, Sequence
 
 from aiogram import Router, F
 from aiogram.fsm.context import FSMContext
@@ -12,10 +10,15 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.bot.FSM.FSM_user_private import RegistrationUser, User_MainStates
 from app.bot.handlers.user_edit_profile import user_view_profile_router
 from app.bot.handlers.user_registartion import user_registration_router
-from app.kbds.inline import get_callback_btns, create_material_buttons
+from app.kbds.inline import get_callback_btns, PageCallback
 from app.kbds.reply import get_keyboard
-from app.database.orm_query import orm_Get_info_user, orm_get_news_by_id, orm_get_all_news, \
-    orm_get_all_themes_by_category_id, orm_get_theme_by_id, orm_Edit_user_profile, orm_get_material_by_id
+from app.bot.common.catalog import catalog, MaterialRecord, ThemeRecord
+from app.bot.common.page_cache import page_cache, RenderedPage
+from app.bot.common.user_status import user_status
+from app.database.orm_query import Page, orm_Get_info_user, orm_get_news_page, \
+    orm_Edit_user_profile, orm_get_list_admin
+from app.database.query_budget import query_budget
+from app.database.writer import run_write
 from app.kbds import reply
 from config import settings
 
@@ -26,48 +29,80 @@ user_private_router = Router()
 user_private_router.include_router(user_registration_router)
 user_private_router.include_router(user_view_profile_router)
 
-# Кэш для хранения текущей новости и темы для каждого пользователя
-# Кэш с тайм-аутом
-CACHE_TIMEOUT = 1800 # 30 минут
-cache_current_news: Dict[int, int] = {}
-cache_current_theme: Dict[int, int] = {}
-cache_current_material: Dict[int, int] = {}
-cache_last_access: Dict[int, float] = {}
-
-
 async def paginate_items(
         message: Union[Message, CallbackQuery],
         session: AsyncSession,
-        user_id: int,
-        item_id: int,
-        cache: Dict[int, int],
-        fetch_func: Callable,
-        format_func: Callable,
-        kb_func: Callable[[list, int], Union[InlineKeyboardMarkup, Awaitable[InlineKeyboardMarkup]]]
+        view: str,
+        page_number: int,
+        fetch_func: Callable[[AsyncSession, int], Awaitable[Page]],
+        format_func: Callable[[Sequence], str],
+        kb_func: Callable[[Page], Optional[InlineKeyboardMarkup]]
 ) -> None:
-    """Универсальная функция для пагинации элементов."""
+    """Универсальная функция для пагинации элементов.
+
+    Номер страницы приходит из PageCallback, поэтому на сервере ничего не хранится.
+    Готовая страница берется из page_cache по (view, page_number) и рендерится только при промахе.
+    fetch_func одним обращением возвращает элементы и признаки соседних страниц.
+    """
     try:
-        if user_id in cache and time() - cache_last_access.get(user_id, 0) > CACHE_TIMEOUT:
-            del cache[user_id]
-
-        cache[user_id] = item_id
-        cache_last_access[user_id] = time()
-        items = await fetch_func(session, item_id)
-        if not items:
-            await (message.answer if isinstance(message, Message) else message.message.edit_text)("Больше элементов нет.")
-            return
-        text = format_func(items)
-        reply_markup_result = kb_func(items, item_id)
-        reply_markup = await reply_markup_result if isinstance(reply_markup_result, Awaitable) else reply_markup_result
+        rendered = page_cache.get(view, page_number)
+        if rendered is None:
+            catalog_version = catalog.version
+            # Новости - один запрос, справочники - три при первой загрузке и ноль потом
+            with query_budget(f"page:{view}", 3):
+                page = await fetch_func(session, page_number)
+            if not page.items:
+                await (message.answer if isinstance(message, Message) else message.message.edit_text)("Больше элементов нет.")
+                return
+            rendered = RenderedPage(format_func(page.items), kb_func(page))
+            page_cache.put(view, page_number, rendered, catalog_version)
         if isinstance(message, Message):
-            await message.answer(text, reply_markup=reply_markup)
+            await message.answer(rendered.text, reply_markup=rendered.reply_markup)
         else:
-            await message.message.edit_text(text, reply_markup=reply_markup)
+            await message.message.edit_text(rendered.text, reply_markup=rendered.reply_markup)
     except Exception as e:
-        logger.error(f"Ошибка пагинации для user_id={user_id}: {e}")
+        logger.error(f"Ошибка пагинации {view} page={page_number} для user_id={message.from_user.id}: {e}")
         await (message.answer if isinstance(message, Message) else message.message.edit_text)("Ошибка загрузки.")
 
 
+def page_nav_btns(view: str, page: Page) -> Dict[str, str]:
+    """Кнопки "Назад"/"Далее" с номерами соседних страниц."""
+    btns = {}
+    if page.has_prev:
+        btns["Назад"] = PageCallback(view=view, page=page.page - 1).pack()
+    if page.has_next:
+        btns["Далее"] = PageCallback(view=view, page=page.page + 1).pack()
+    return btns
+
+
+def format_materials(materials: Sequence[MaterialRecord]) -> str:
+    return "\n".join(f"{m.id}🟦 {m.title}" for m in materials)
+
+
+def materials_kb(page: Page) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    for material in page.items:
+        if material.link:
+            builder.button(text=f"Материал №{material.id}", url=material.link)
+        else:
+            builder.button(text=f"Материал №{material.id} (нет ссылки)", callback_data=f"no_link_{material.id}")
+    for text, data in page_nav_btns("material", page).items():
+        builder.button(text=text, callback_data=data)
+    builder.adjust(3, 3, 2)
+    return builder.as_markup()
+
+
+def format_themes(themes: Sequence[ThemeRecord]) -> str:
+    return f"Категория: {themes[0].category_title}\n\n" + "\n".join(
+        f"{t.id}🟦 {t.title}\n📌Прием: {t.technique}" for t in themes)
+
+
+def themes_kb(page: Page) -> InlineKeyboardMarkup:
+    btns = {f"Тема №{t.id}": f"choice_theme_{t.id}" for t in page.items} if settings.prod else {}
+    btns.update(page_nav_btns("theme", page))
+    return get_callback_btns(btns=btns, sizes=(3, 3, 2))
+
+
 # Команда /menu для открытия меню
 # @user_private_router.message(Command('menu'))
 # async def menu(message: Message) -> None:
@@ -99,73 +134,43 @@ async def news(message: Message, session: AsyncSession) -> None:
 
 
 # Обработчик для переключения между новостями
-@user_private_router.callback_query(F.data.startswith('news_'))
-async def slide_news(callback: CallbackQuery, session: AsyncSession) -> None:
+@user_private_router.callback_query(PageCallback.filter(F.view == "news"))
+async def slide_news(callback: CallbackQuery, callback_data: PageCallback, session: AsyncSession) -> None:
     """Переключает новости вперед или назад."""
-    user_id = callback.from_user.id
-    action = callback.data.split("_")[1]  # Определяем действие (next или back)
-    current_news_id = cache_current_news.get(user_id, 1)
-    new_id = current_news_id + 1 if action == 'next' else max(1, current_news_id - 1)
-
-    async def kb_func(news, _):
-        next_exists = await orm_get_news_by_id(session, new_id + 1)
-        return get_callback_btns(btns={"Назад": "news_back", "Далее": "news_next" if next_exists else None})
-
     await paginate_items(
-        callback, session, user_id, new_id, cache_current_news,
-        orm_get_news_by_id,
-        lambda n: f"<strong>{n.text}</strong>",
-        kb_func
+        callback, session, "news", max(1, callback_data.page),
+        orm_get_news_page,
+        lambda ns: f"<strong>{ns[0].text}</strong>",
+        lambda page: get_callback_btns(btns=page_nav_btns("news", page))
     )
     await callback.answer()
 
 
+# Кнопки "Назад"/"Далее" из сообщений, отправленных до перехода на PageCallback
+@user_private_router.callback_query(F.data.in_({
+    "news_next", "news_back", "slide_material_next", "slide_material_back", "slide_theme_next", "slide_theme_back"
+}))
+async def outdated_page_button(callback: CallbackQuery) -> None:
+    """Просит открыть список заново: номер страницы в старых кнопках не хранился."""
+    await callback.answer("Список устарел, откройте его заново из меню.", show_alert=True)
+
+
 
 # Обработчик для команды "материалы"
 @user_private_router.message(F.text.lower() == 'материалы')
 async def get_material(message: Message, session: AsyncSession, state: FSMContext) -> None:
     """Показывает список материалов с ссылками."""
-    user_id = message.from_user.id
-    await paginate_items(
-        message, session, user_id, 0, cache_current_material,
-        orm_get_material_by_id,
-        lambda ms: "\n".join(f"{m.id}🟦 {m.title}" for m in ms) if ms else "Материалы отсутствуют",
-        lambda ms, _: create_material_buttons(ms) if ms else None
-    )
+    await paginate_items(message, session, "material", 0, catalog.materials_page, format_materials, materials_kb)
 
 
 
 
-@user_private_router.callback_query(F.data.startswith('slide_material_'))
-async def slide_material(callback: CallbackQuery, session: AsyncSession) -> None:
+@user_private_router.callback_query(PageCallback.filter(F.view == "material"))
+async def slide_material(callback: CallbackQuery, callback_data: PageCallback, session: AsyncSession) -> None:
     """Переключает материалы вперед или назад."""
-    user_id = callback.from_user.id
-    action = callback.data.split("_")[2]
-    current_id = cache_current_material.get(user_id, 0)
-    new_id = current_id + 1 if action == 'next' else max(0, current_id - 1)
-
-    async def kb_func(mats, _):
-        next_exists_task = asyncio.create_task(orm_get_material_by_id(session, new_id + 1))
-        prev_exists = new_id > 0
-        next_exists = await next_exists_task
-        builder = InlineKeyboardBuilder()
-        for material in mats:
-            if material.link:
-                builder.button(text=f"Материал №{material.id}", url=material.link)
-            else:
-                builder.button(text=f"Материал №{material.id} (нет ссылки)", callback_data=f"no_link_{material.id}")
-        if prev_exists:
-            builder.button(text="Назад", callback_data="slide_material_back")
-        if next_exists:
-            builder.button(text="Далее", callback_data="slide_material_next")
-        builder.adjust(3, 3, 2)
-        return builder.as_markup()
-
     await paginate_items(
-        callback, session, user_id, new_id, cache_current_material,
-        orm_get_material_by_id,
-        lambda ms: "\n".join(f"{m.id}🟦 {m.title}" for m in ms),
-        kb_func
+        callback, session, "material", max(0, callback_data.page),
+        catalog.materials_page, format_materials, materials_kb
     )
 
 
@@ -220,18 +225,7 @@ async def slide_material(callback: CallbackQuery, session: AsyncSession) -> None
 @user_private_router.message(F.text.lower() == 'посмотреть темы')
 async def get_theme(message: Message, session: AsyncSession, state: FSMContext) -> None:
     """Показывает список тем."""
-    user_id = message.from_user.id
-    await paginate_items(
-        message, session, user_id, 1, cache_current_theme,
-        orm_get_all_themes_by_category_id,
-        lambda ts: f"Категория: {ts[0].category.title}\n\n" + "\n".join(
-            f"{t.id}🟦 {t.title}\n📌Прием: {t.technique}" for t in ts),
-        lambda ts, _: get_callback_btns(
-            btns=({f"Тема №{t.id}": f"choice_theme_{t.id}" for t in ts} if settings.prod else {}) | {
-                "Далее": "slide_theme_next"},
-            sizes=(3, 3, 2)
-        )
-    )
+    await paginate_items(message, session, "theme", 1, catalog.theme_page, format_themes, themes_kb)
 
     # user_id = message.from_user.id
     # cache_current_theme[user_id] = 1  # Устанавливаем начальную тему
@@ -255,30 +249,12 @@ async def get_theme(message: Message, session: AsyncSession, state: FSMContext)
     #     await message.answer("Темы пока отсутствуют")
 
 # Обработчик для переключения между темами
-@user_private_router.callback_query(F.data.startswith('slide_theme_'))
-async def choice_theme(callback: CallbackQuery, session: AsyncSession) -> None:
+@user_private_router.callback_query(PageCallback.filter(F.view == "theme"))
+async def slide_theme(callback: CallbackQuery, callback_data: PageCallback, session: AsyncSession) -> None:
     """Переключает категории тем."""
-    user_id = callback.from_user.id
-    action = callback.data.split("_")[2]
-    current_id = cache_current_theme.get(user_id, 1)
-    new_id = current_id + 1 if action == 'next' else max(1, current_id - 1)
-
-    async def kb_func(themes, _):
-        next_exists = await orm_get_all_themes_by_category_id(session, new_id + 1)
-        prev_exists = new_id > 1
-        btns = {f"Тема №{t.id}": f"choice_theme_{t.id}" for t in themes} if settings.prod else {}
-        if prev_exists:
-            btns["Назад"] = "slide_theme_back"
-        if next_exists:
-            btns["Далее"] = "slide_theme_next"
-        return get_callback_btns(btns=btns, sizes=(3, 3, 2))
-
     await paginate_items(
-        callback, session, user_id, new_id, cache_current_theme,
-        orm_get_all_themes_by_category_id,
-        lambda ts: f"Категория: {ts[0].category.title}\n\n" + "\n".join(
-            f"{t.id}🟦 {t.title}\n📌Прием: {t.technique}" for t in ts),
-        kb_func
+        callback, session, "theme", max(1, callback_data.page),
+        catalog.theme_page, format_themes, themes_kb
     )
     # user_id = callback.from_user.id
     # action = callback.data.split('_')[2]  # Определяем действие (next или back)
@@ -330,7 +306,11 @@ async def choice_theme(callback: CallbackQuery, session: AsyncSession) -> None:
 async def choice_theme(callback: CallbackQuery, session: AsyncSession, state: FSMContext) -> None:
     """Подтверждение выбора темы."""
     theme_id = int(callback.data.split('_')[2])
-    theme = await orm_get_theme_by_id(session, theme_id)
+    theme = await catalog.theme(session, theme_id)
+    if theme is None:
+        # Кнопка из старого сообщения: тему убрали из каталога
+        await callback.answer("Тема не найдена, откройте список тем заново", show_alert=True)
+        return
     await state.update_data(prev_message_id=callback.message.message_id)
     await callback.message.answer(
         f"Вы выбираете тему:\n\n🟦 {theme.title}\n📌Прием: {theme.technique}\n\nПодтверждаете выбор?",
@@ -361,8 +341,12 @@ async def confirm_theme(callback: CallbackQuery, session: AsyncSession, state: F
     confirm_theme_id = callback.data.split("_")[2]
     if confirm_theme_id:
         user_id = callback.from_user.id
-        theme = await orm_get_theme_by_id(session, int(confirm_theme_id))
-        await orm_Edit_user_profile(session, user_id, {'edit_theme': f"{theme.title} {theme.technique}"})
+        theme = await catalog.theme(session, int(confirm_theme_id))
+        if theme is None:
+            await callback.answer("Тема не найдена, откройте список тем заново", show_alert=True)
+            return
+        await run_write(session, orm_Edit_user_profile, user_id, {'edit_theme': f"{theme.title} {theme.technique}"})
+        user_status.invalidate(user_id)
         state_data = await state.get_data()
         await callback.bot.delete_messages(callback.message.chat.id,
                                            [callback.message.message_id, state_data.get("prev_message_id")])
@@ -396,7 +380,8 @@ async def confirm_theme(callback: CallbackQuery, session: AsyncSession, state: F
 @user_private_router.message(User_MainStates.after_registration, F.text.lower() == 'мой профиль')
 async def get_user_profile(message: Message, session: AsyncSession, state: FSMContext) -> None:
     """Показывает профиль пользователя."""
-    data = await orm_Get_info_user(session, message.from_user.id)
+    with query_budget("profile", 1):
+        data = await orm_Get_info_user(session, message.from_user.id)
     if data:
         await state.set_state(User_MainStates.user_view_profile)
         text = (f"📄ФИО: {data.name}\n🏫Школа: {data.school}\n📱Номер телефона: {data.phone_number}\n"
@@ -431,6 +416,20 @@ async def get_user_profile(message: Message, session: AsyncSession, state: FSMCo
     #     await message.answer("Профиль не найден")
 
 
+# Команда /reload_catalog для сброса кэша тем и материалов
+@user_private_router.message(Command('reload_catalog'))
+async def reload_catalog(message: Message, session: AsyncSession) -> None:
+    """Сбрасывает кэш справочников после изменения тем или материалов в БД."""
+    if message.from_user.username != settings.admin_user_nick \
+            and message.from_user.id not in await orm_get_list_admin(session):
+        await message.answer("У вас недостаточно прав")
+        return
+    catalog.invalidate()
+    await catalog.ensure_loaded(session)
+    logger.info(f"Пользователь {message.from_user.id} обновил справочники")
+    await message.answer(f"Справочники обновлены (версия {catalog.version})")
+
+
 
 
 
@@ -14,7 +14,10 @@ from app.bot.common.verif_mail import start_verify_mail, \
     check_verify_code
 from app.kbds import reply
 from app.kbds.inline import role_inline_kb
-from app.database.orm_query import orm_Change_RegStaus, orm_AddActiveUser
+from app.bot.common.user_status import user_status
+from app.database.orm_query import orm_register_user
+from app.database.query_budget import query_budget
+from app.database.writer import run_write
 
 
 logger = logging.getLogger(__name__)
@@ -79,7 +82,7 @@ async def register_step_name_mentor(message: Message, state: FSMContext) -> None
             logger.info(f"Пользователь {message.from_user.id} ввел почту: {email}")
             await state.update_data(mail=email)
             await start_verify_mail(email, message.from_user.id)
-            await message.answer(text="На вашу почту был отправлен код подтверждения. Пожалуйста введите код")
+            await message.answer(text="Отправляем на вашу почту код подтверждения, я сообщу, когда письмо уйдет. Пожалуйста введите код из письма")
             await state.set_state(RegistrationUser.verify_mail)
         else:
             await message.answer(text="Неверный формат электронной почты. Пожалуйста введите почту в правильном формате")
@@ -91,7 +94,7 @@ async def register_step_name_mentor(message: Message, state: FSMContext) -> None
 @user_registration_router.message(RegistrationUser.verify_mail, F.text)
 async def register_step_verify_mail(message: Message, state: FSMContext) -> None:
     """Проверяет код верификации почты."""
-    if check_verify_code(message.text, message.from_user.id):
+    if await check_verify_code(message.text, message.from_user.id):
         logger.info(f"Пользователь {message.from_user.id} подтвердил почту")
         await message.answer("Подтверждение почты успешно пройдено")
         await message.answer("Введите ФИО вашего наставника в формате (Фамилия Имя Отчество)")
@@ -149,8 +152,11 @@ async def register_step_finish(message: Message, state: FSMContext, session: Asy
     try:
         data = await state.get_data()
         data["user_id"] = user_id
-        await orm_Change_RegStaus(session, user_id, True)
-        await orm_AddActiveUser(session, data)
+        with query_budget("register", 2):
+            registered = await run_write(session, orm_register_user, data)
+        if not registered:
+            raise RuntimeError("регистрация не сохранена")
+        user_status.invalidate(user_id)
         logger.info(f"Пользователь {user_id} завершил регистрацию")
         await message.answer('Регистрация успешно пройдена.', reply_markup=reply.menu_kb)
         await message.answer("""
@@ -1,12 +1,35 @@
-from typing import Any, Awaitable, Callable, Dict
+from typing import Any, Awaitable, Callable, Dict, Optional
 from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject
-from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+
+
+class LazySession:
+    """Прокси AsyncSession: настоящая сессия создается только при первом обращении."""
+
+    def __init__(self, session_pool: async_sessionmaker):
+        self._session_pool = session_pool
+        self._session: Optional[AsyncSession] = None
+
+    @property
+    def opened(self) -> bool:
+        return self._session is not None
+
+    def __getattr__(self, name: str) -> Any:
+        if self._session is None:
+            self._session = self._session_pool()
+        return getattr(self._session, name)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
 
 
 class DataBaseSession(BaseMiddleware):
     def __init__(self, session_pool: async_sessionmaker):
         self.session_pool = session_pool
+        self.updates_total = 0  # Всего апдейтов
+        self.updates_with_db = 0  # Апдейтов, которым понадобилась БД
 
     async def __call__(
             self,
@@ -14,8 +37,17 @@ class DataBaseSession(BaseMiddleware):
             event: TelegramObject,
             data: Dict[str, Any],
     ):
-        async with self.session_pool() as session:
-            data['session'] = session
+        session = LazySession(self.session_pool)
+        data['session'] = session
+        data['session_pool'] = self.session_pool
+        self.updates_total += 1
+        try:
             return await handler(event, data)
+        finally:
+            if session.opened:
+                self.updates_with_db += 1
+            await session.close()
 
-
+    def stats(self) -> Dict[str, int]:
+        """Сколько апдейтов обработано и скольким из них понадобилась БД."""
+        return {"updates": self.updates_total, "with_db": self.updates_with_db}
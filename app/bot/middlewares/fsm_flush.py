@@ -0,0 +1,26 @@
+from typing import Any, Awaitable, Callable, Dict, Optional
+from aiogram import BaseMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.types import TelegramObject
+
+from app.bot.FSM.storage import SQLAlchemyStorage
+
+
+class FSMFlushMiddleware(BaseMiddleware):
+    """Сохраняет изменения FSM пользователя одной записью после обработки апдейта."""
+
+    def __init__(self, storage: SQLAlchemyStorage):
+        self.storage = storage
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ):
+        try:
+            return await handler(event, data)
+        finally:
+            state: Optional[FSMContext] = data.get("state")
+            if state is not None:
+                await self.storage.flush(state.key)
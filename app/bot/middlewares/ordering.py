@@ -0,0 +1,86 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, Hashable, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.storage.base import BaseEventIsolation, StorageKey
+from aiogram.types import TelegramObject
+
+
+class UserEventIsolation(BaseEventIsolation):
+    """Строгий порядок апдейтов одного пользователя: блокировка на ключ FSM.
+
+    Dispatcher берет ее до чтения состояния, поэтому следующий апдейт пользователя
+    видит состояние, оставленное предыдущим. asyncio.Lock отдает блокировку в порядке
+    очереди, блокировка удаляется, когда очередь пользователя опустела.
+    """
+
+    def __init__(self):
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self._depth: Dict[Hashable, int] = {}
+
+    @staticmethod
+    def _ordering_key(key: StorageKey) -> Hashable:
+        # Один пользователь в разных чатах тоже обрабатывается по порядку
+        return key.bot_id, key.user_id
+
+    @asynccontextmanager
+    async def lock(self, key: StorageKey) -> AsyncGenerator[None, None]:
+        ordering_key = self._ordering_key(key)
+        lock = self._locks.setdefault(ordering_key, asyncio.Lock())
+        self._depth[ordering_key] = self._depth.get(ordering_key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._depth[ordering_key] -= 1
+            if not self._depth[ordering_key]:
+                del self._depth[ordering_key]
+                del self._locks[ordering_key]
+
+    async def close(self) -> None:
+        self._locks.clear()
+        self._depth.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Сколько пользователей с апдейтами в работе и самая длинная очередь одного пользователя."""
+        return {"users": len(self._depth), "max_user_depth": max(self._depth.values(), default=0)}
+
+
+class UserOrderingMiddleware(BaseMiddleware):
+    """Ограничивает число одновременно обрабатываемых апдейтов max_concurrency.
+
+    Порядок апдейтов одного пользователя обеспечивает UserEventIsolation: middleware
+    вызывается уже под его блокировкой, поэтому апдейты, ждущие своей очереди, слот не занимают.
+    """
+
+    def __init__(self, max_concurrency: int = 100, isolation: Optional[UserEventIsolation] = None):
+        self.max_concurrency = max_concurrency
+        self.isolation = isolation
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._running = 0
+        self._total = 0
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ):
+        self._total += 1
+        try:
+            async with self._semaphore:
+                self._running += 1
+                try:
+                    return await handler(event, data)
+                finally:
+                    self._running -= 1
+        finally:
+            self._total -= 1
+
+    def stats(self) -> Dict[str, int]:
+        """Метрики очередей: сколько апдейтов в работе и сколько ждут своей очереди."""
+        stats = {"running": self._running, "waiting": self._total - self._running}
+        if self.isolation is not None:
+            stats.update(self.isolation.stats())
+        return stats
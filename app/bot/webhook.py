@@ -0,0 +1,109 @@
+import asyncio
+import hashlib
+import logging
+from typing import Any, Dict, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """Обработчик вебхука с ограничением числа одновременно обрабатываемых апдейтов.
+
+    Апдейты обрабатываются в фоне, Telegram сразу получает ответ. Когда в работе уже
+    max_in_flight апдейтов, новые отклоняются с 503 и Telegram присылает их повторно позже.
+    Фоновые задачи ведет сам обработчик через публичные методы Dispatcher, не опираясь
+    на внутренности SimpleRequestHandler.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, max_in_flight: int, **kwargs: Any):
+        super().__init__(dispatcher, bot, **kwargs)
+        self.max_in_flight = max_in_flight
+        self.rejected = 0
+        self._in_flight: Set[asyncio.Task] = set()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    async def _feed_update(self, bot: Bot, update: Dict[str, Any]) -> None:
+        result = await self.dispatcher.feed_raw_update(bot, update, **self.data)
+        if isinstance(result, TelegramMethod):
+            await self.dispatcher.silent_call_request(bot, result)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        bot = await self.resolve_bot(request)
+        if not self.verify_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), bot):
+            return web.Response(status=401, text="Unauthorized")
+        if self.in_flight >= self.max_in_flight:
+            self.rejected += 1
+            logger.warning(f"Вебхук перегружен: в работе {self.in_flight} апдейтов, апдейт отклонен")
+            return web.Response(status=503, text="Too many updates in flight")
+        task = asyncio.create_task(self._feed_update(bot, await request.json(loads=bot.session.json_loads)))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    __call__ = handle
+
+
+# Обработчик вебхука в aiohttp-приложении (для метрик и тестов)
+WEBHOOK_HANDLER_KEY = web.AppKey("webhook_handler", BoundedRequestHandler)
+
+
+def webhook_secret_token() -> str:
+    """Секрет вебхука: WEBHOOK_SECRET или производный от токена бота.
+
+    Одинаков во всех процессах бота за балансировщиком: каждый из них вызывает set_webhook,
+    и случайный секрет у каждого свой оставил бы рабочим только последний процесс.
+    """
+    if settings.webhook_secret:
+        return settings.webhook_secret
+    return hashlib.sha256(f"webhook:{settings.bot_token}".encode()).hexdigest()
+
+
+def create_webhook_app(dp: Dispatcher, bot: Bot, secret_token: str, path: str = None,
+                       max_in_flight: int = None, **data: Any) -> web.Application:
+    """Создает aiohttp-приложение, передающее апдейты из вебхука в диспетчер."""
+    app = web.Application()
+    handler = BoundedRequestHandler(
+        dp, bot,
+        max_in_flight=max_in_flight or settings.webhook_max_in_flight,
+        secret_token=secret_token,
+        **data
+    )
+    handler.register(app, path=path or settings.webhook_path)
+    app[WEBHOOK_HANDLER_KEY] = handler
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, **set_webhook_kwargs: Any) -> None:
+    """Запускает бота в режиме вебхука на встроенном aiohttp-сервере."""
+    if not settings.webhook_base_url:
+        raise RuntimeError("Для режима вебхука нужен WEBHOOK_BASE_URL")
+    secret_token = webhook_secret_token()
+    app = create_webhook_app(dp, bot, secret_token)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=settings.webhook_host, port=settings.webhook_port)
+    await site.start()
+    try:
+        url = settings.webhook_base_url.rstrip("/") + settings.webhook_path
+        await bot.set_webhook(
+            url,
+            secret_token=secret_token,
+            max_connections=min(100, settings.webhook_max_in_flight),
+            **set_webhook_kwargs
+        )
+        logger.info(f"Вебхук {url} слушает {settings.webhook_host}:{settings.webhook_port}")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
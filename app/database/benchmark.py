@@ -0,0 +1,77 @@
+"""Сравнение пропускной способности профилей движка.
+
+Запуск: python -m app.database.benchmark [URL ...] [--users N] [--concurrency N]
+Без URL используется временный файл SQLite. Для PostgreSQL нужна пустая тестовая база:
+таблицы создаются и удаляются бенчмарком.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, AsyncSession, create_async_engine
+
+from app.database.models import Base
+from app.database.orm_query import orm_ensure_user, orm_Check_register_user
+from app.database.profiles import create_engine_for
+
+# Параметры, с которыми движок создавался до профилей, - точка отсчета
+LEGACY_OPTIONS: Dict[str, Any] = {
+    "pool_size": 20, "max_overflow": 10, "pool_timeout": 30, "pool_pre_ping": True, "query_cache_size": 500,
+}
+
+
+async def _run(session_pool: async_sessionmaker, concurrency: int, ops: List, op) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(arg):
+        async with semaphore:
+            async with session_pool() as session:
+                await op(session, arg)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(arg) for arg in ops))
+    return len(ops) / (time.perf_counter() - started)
+
+
+async def bench_engine(name: str, engine: AsyncEngine, users: int, concurrency: int) -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    session_pool = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    ids = list(range(10 ** 10, 10 ** 10 + users))
+    try:
+        writes = await _run(session_pool, concurrency, ids, lambda s, uid: orm_ensure_user(s, uid, f"user{uid}"))
+        reads = await _run(session_pool, concurrency, ids, orm_Check_register_user)
+        print(f"{name:<40} запись {writes:>9.0f} оп/с   чтение {reads:>9.0f} оп/с")
+    finally:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+        await engine.dispose()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("urls", nargs="*", help="URL баз для проверки (по умолчанию временный SQLite)")
+    parser.add_argument("--users", type=int, default=2000, help="Число пользователей (операций каждого вида)")
+    parser.add_argument("--concurrency", type=int, default=20, help="Число одновременных сессий")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        urls = args.urls or [f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}"]
+        for url in urls:
+            backend = url.split(":", 1)[0]
+            try:
+                legacy = create_async_engine(url, **LEGACY_OPTIONS)
+            except TypeError as e:
+                # Например, SQLite в памяти: StaticPool не принимает параметры очереди
+                print(f"{backend} / прежние настройки: неприменимы ({e})")
+            else:
+                await bench_engine(f"{backend} / прежние настройки", legacy, args.users, args.concurrency)
+            await bench_engine(f"{backend} / профиль", create_engine_for(url), args.users, args.concurrency)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,28 +1,63 @@
-from sqlalchemy import QueuePool
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+import logging
+
+from sqlalchemy import inspect
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+from sqlalchemy.schema import CreateColumn
 
 from config import settings
 from app.database.models import Base
+from app.database.profiles import create_engine_for
+from app.database.query_budget import install_query_budget
+from app.database.writer import install_write_queue
 
+logger = logging.getLogger(__name__)
 
-engine = create_async_engine(
-    settings.db_lite,
-    pool_size=20,  # Максимальное количество соединений в пуле
-    max_overflow=10,  # Дополнительные соединения при переполнении
-    pool_timeout=30,  # Тайм-аут ожидания соединения (в секундах)
-    pool_pre_ping=True,  # Проверка соединения перед использованием
-    echo=False,  # Отключение логирования SQL-запросов
-    query_cache_size = 500
-)
+# Настройки пула и PRAGMA подбираются по URL: SQLite (WAL) или PostgreSQL
+engine = create_engine_for(settings.db_url)
 
 session_maker = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
 
+# Очередь записи: операции из обработчиков выполняются пакетами на отдельном соединении писателя
+write_queue = (
+    install_write_queue(settings.db_url, max_batch=settings.write_batch_size, max_delay=settings.write_batch_delay)
+    if settings.write_queue else None
+)
+
+# Контроль числа запросов на горячих путях (warn - предупреждение в лог, strict - исключение, для тестов).
+# Запросы писателя засчитываются в бюджет обработчика, поставившего операцию в очередь
+if settings.query_budget_mode != "off":
+    install_query_budget(engine, strict=settings.query_budget_mode == "strict")
+    if write_queue is not None:
+        install_query_budget(write_queue.engine, strict=settings.query_budget_mode == "strict")
+
+
+
 
+def upgrade_schema(conn: Connection) -> None:
+    """Добавляет в существующие таблицы новые столбцы и индексы (create_all их не трогает)."""
+    inspector = inspect(conn)
+    existing_tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            if not column.nullable and column.server_default is None:
+                raise RuntimeError(f"Столбец {table.name}.{column.name} NOT NULL без server_default: нужна ручная миграция")
+            ddl = CreateColumn(column).compile(dialect=conn.dialect)
+            conn.exec_driver_sql(f"ALTER TABLE {conn.dialect.identifier_preparer.format_table(table)} ADD COLUMN {ddl}")
+            logger.info(f"В таблицу {table.name} добавлен столбец {column.name}")
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
 
 
 async def create_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade_schema)
 
 
 async def drop_db():
@@ -1,6 +1,8 @@
+from datetime import datetime, timezone
 from typing import List, Optional
 
-from sqlalchemy import String, Boolean, Text, DateTime, func, ForeignKey, Index, ForeignKeyConstraint
+from sqlalchemy import String, Boolean, Text, DateTime, func, ForeignKey, Index, ForeignKeyConstraint, Integer, \
+    BigInteger, false
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 # Базовый класс для всех моделей
@@ -8,22 +10,37 @@ class Base(DeclarativeBase):
     """Базовый класс для всех моделей базы данных."""
     pass
 
+# Telegram ID пользователей и каналов не помещаются в 32 бита: в PostgreSQL нужен BIGINT.
+# В SQLite INTEGER и так 64-битный, а INTEGER PRIMARY KEY остается псевдонимом rowid.
+TelegramId = BigInteger().with_variant(Integer, "sqlite")
+
+
+def utcnow() -> datetime:
+    """Текущее время UTC без часового пояса - в нем хранятся и сравниваются метки времени бота."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# Связи по умолчанию не загружаются (lazy="raise_on_sql": обращение без явной загрузки - ошибка).
+# Нужные связанные строки запрос подгружает сам через options(selectinload(...)).
+
 # Модель для всех пользователей
 class User(Base):
     """Модель всех пользователей бота."""
     __tablename__ = "user"
-    __table_args__ = (Index("idx_user_user_id", "user_id"),)
+    __table_args__ = (Index("idx_user_user_id", "user_id"), Index("idx_user_unreachable", "unreachable"))
 
-    user_id: Mapped[int] = mapped_column(primary_key=True)  # Уникальный Telegram ID как первичный ключ
+    user_id: Mapped[int] = mapped_column(TelegramId, primary_key=True, autoincrement=False)  # Уникальный Telegram ID как первичный ключ
     nickname: Mapped[str] = mapped_column(String(50), nullable=False)  # Никнейм пользователя
     reg_status: Mapped[bool] = mapped_column(Boolean, default=False)  # Статус регистрации
+    unreachable: Mapped[bool] = mapped_column(Boolean, default=False, server_default=false())  # Заблокировал бота или удален, в рассылки не входит
+    unreachable_reason: Mapped[Optional[str]] = mapped_column(String(20), nullable=True)  # forbidden / chat_not_found / deactivated
 
     # Связь один к одному с ActiveUser
     active_profile: Mapped[Optional["ActiveUser"]] = relationship(
         "ActiveUser",
         back_populates="user",
         uselist=False,
-        lazy="selectin"
+        lazy="raise_on_sql"
     )
 
 # Модель для активных пользователей
@@ -35,7 +52,7 @@ class ActiveUser(Base):
         Index("idx_active_user_user_id", "user_id"),
     )
 
-    user_id: Mapped[int] = mapped_column(ForeignKey("user.user_id"), primary_key=True)  # Telegram ID как первичный и внешний ключ
+    user_id: Mapped[int] = mapped_column(TelegramId, ForeignKey("user.user_id"), primary_key=True)  # Telegram ID как первичный и внешний ключ
     name: Mapped[str] = mapped_column(String(150), nullable=False)  # ФИО пользователя
     school: Mapped[str] = mapped_column(String(100), nullable=False)  # Название школы
     phone_number: Mapped[str] = mapped_column(String(15), nullable=False)  # Номер телефона (+79991234567)
@@ -48,16 +65,17 @@ class ActiveUser(Base):
     user: Mapped["User"] = relationship(
         "User",
         back_populates="active_profile",
-        lazy="selectin"
+        lazy="raise_on_sql"
     )
 
 # Модель для новостей
 class News(Base):
     """Модель новостей для бота."""
     __tablename__ = "news"
-    __table_args__ = (Index("idx_news_date", "date"),)
+    __table_args__ = (Index("idx_news_date", "date"), Index("idx_news_post_id", "post_id"))
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    post_id: Mapped[Optional[int]] = mapped_column(nullable=True)  # ID поста в канале новостей
     text: Mapped[str] = mapped_column(Text, nullable=True)  # Текст новости
     image: Mapped[str] = mapped_column(String(150), nullable=True)  # Ссылка на изображение
     date: Mapped[DateTime] = mapped_column(DateTime, default=func.now(), onupdate=func.now())  # Дата создания/обновления
@@ -69,7 +87,7 @@ class Admin(Base):
     __tablename__ = "admin"
     __table_args__ = (Index("idx_admin_user_id", "user_id"),)
 
-    user_id: Mapped[int] = mapped_column(primary_key=True)  # Уникальный Telegram ID как первичный ключ
+    user_id: Mapped[int] = mapped_column(TelegramId, primary_key=True, autoincrement=False)  # Уникальный Telegram ID как первичный ключ
     nickname: Mapped[str] = mapped_column(String(50), nullable=False)  # Никнейм администратора
 
 
@@ -82,7 +100,7 @@ class CategoryTheme(Base):
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     title: Mapped[str] = mapped_column(String(150), nullable=False)  # Название категории
 
-    themes: Mapped[List["Theme"]] = relationship("Theme", back_populates="category", lazy="selectin")
+    themes: Mapped[List["Theme"]] = relationship("Theme", back_populates="category", lazy="raise_on_sql")
 
 
 # Модель для тем
@@ -96,7 +114,7 @@ class Theme(Base):
     technique: Mapped[str] = mapped_column(String(50), nullable=False)  # Техника выполнения
     category_id: Mapped[int] = mapped_column(ForeignKey("category_theme.id"), nullable=False)
 
-    category: Mapped["CategoryTheme"] = relationship("CategoryTheme", back_populates="themes", lazy="selectin")
+    category: Mapped["CategoryTheme"] = relationship("CategoryTheme", back_populates="themes", lazy="raise_on_sql")
 
 class Material(Base):
     """Модель материалов для участников."""
@@ -105,3 +123,84 @@ class Material(Base):
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     title: Mapped[str] = mapped_column(Text, nullable=False)  # Название материала
     link: Mapped[str] = mapped_column(String(150), nullable=False)  # Ссылка на материал
+
+
+# Модель для задач рассылки
+class BroadcastJob(Base):
+    """Модель задачи рассылки с курсором по user_id для возобновления после перезапуска."""
+    __tablename__ = "broadcast_job"
+    __table_args__ = (
+        Index("idx_broadcast_job_status", "status"),
+        Index("idx_broadcast_job_dedup_key", "dedup_key", unique=True),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    kind: Mapped[str] = mapped_column(String(20), nullable=False)  # send - текст, forward - пересылка поста
+    text: Mapped[Optional[str]] = mapped_column(Text, nullable=True)  # Текст для kind=send
+    from_chat_id: Mapped[Optional[int]] = mapped_column(TelegramId, nullable=True)  # Канал для kind=forward
+    message_id: Mapped[Optional[int]] = mapped_column(nullable=True)  # Пост для kind=forward
+    status: Mapped[str] = mapped_column(String(20), default="running")  # running / done
+    cursor: Mapped[int] = mapped_column(TelegramId, default=0)  # Последний взятый в работу user_id
+    sent: Mapped[int] = mapped_column(Integer, default=0)  # Доставлено сообщений
+    failed: Mapped[int] = mapped_column(Integer, default=0)  # Не доставлено сообщений
+    created_at: Mapped[DateTime] = mapped_column(DateTime, default=utcnow)  # UTC по часам бота, как и since в проверке недавних рассылок
+    finished_at: Mapped[Optional[DateTime]] = mapped_column(DateTime, nullable=True)
+    claimed_by: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)  # Процесс, который ведет рассылку
+    lease_until: Mapped[Optional[DateTime]] = mapped_column(DateTime, nullable=True)  # До какого времени (UTC) задача за ним
+    dedup_key: Mapped[Optional[str]] = mapped_column(String(50), nullable=True)  # Одна рассылка на ключ (окно дедупликации)
+
+
+# Модель для отметок доставки рассылки
+class BroadcastDelivery(Base):
+    """Модель отметки доставки рассылки конкретному пользователю."""
+    __tablename__ = "broadcast_delivery"
+    __table_args__ = (Index("idx_broadcast_delivery_job_status", "job_id", "status"),)
+
+    job_id: Mapped[int] = mapped_column(ForeignKey("broadcast_job.id", ondelete="CASCADE"), primary_key=True)
+    user_id: Mapped[int] = mapped_column(TelegramId, primary_key=True, autoincrement=False)
+    status: Mapped[str] = mapped_column(String(20), default="pending")  # pending / sent / failed
+
+
+# Модель для состояний FSM
+class FSMRecord(Base):
+    """Модель сохраненного состояния FSM пользователя, чтобы перезапуск не сбрасывал регистрацию."""
+    __tablename__ = "fsm_state"
+
+    key: Mapped[str] = mapped_column(String(200), primary_key=True)  # bot_id:chat_id:user_id:thread_id:business_connection_id:destiny
+    state: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)  # Текущее состояние
+    data: Mapped[str] = mapped_column(Text, default="{}")  # Данные FSM в JSON
+    updated_at: Mapped[DateTime] = mapped_column(DateTime, default=func.now(), onupdate=func.now())
+
+
+# Модель для кодов подтверждения почты
+class VerificationToken(Base):
+    """Модель кода подтверждения почты, общего для всех процессов бота."""
+    __tablename__ = "verification_token"
+    __table_args__ = (Index("idx_verification_token_expires_at", "expires_at"),)
+
+    user_id: Mapped[int] = mapped_column(TelegramId, primary_key=True, autoincrement=False)  # Telegram ID, у пользователя один действующий код
+    token: Mapped[str] = mapped_column(String(32), nullable=False)  # Код из письма
+    expires_at: Mapped[DateTime] = mapped_column(DateTime, nullable=False)  # Срок действия (UTC)
+
+
+# Модель для очереди исходящих писем
+class OutboxEmail(Base):
+    """Модель письма в очереди отправки: обработчики только ставят письмо, отправляет фоновый воркер."""
+    __tablename__ = "email_outbox"
+    __table_args__ = (
+        Index("idx_email_outbox_status_next_attempt", "status", "next_attempt_at"),
+        Index("idx_email_outbox_user_id", "user_id"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    user_id: Mapped[Optional[int]] = mapped_column(TelegramId, nullable=True)  # Кому сообщить в Telegram о результате
+    recipient: Mapped[str] = mapped_column(String(254), nullable=False)  # Адрес получателя
+    domain: Mapped[str] = mapped_column(String(253), nullable=False)  # Домен получателя для ограничения параллельности
+    subject: Mapped[str] = mapped_column(String(200), nullable=False)
+    body: Mapped[str] = mapped_column(Text, nullable=False)
+    status: Mapped[str] = mapped_column(String(20), default="pending")  # pending / sending / sent / failed
+    attempts: Mapped[int] = mapped_column(Integer, default=0)  # Сделано попыток отправки
+    next_attempt_at: Mapped[DateTime] = mapped_column(DateTime, nullable=False)  # Когда пробовать снова (UTC), для sending - до какого времени письмо занято
+    last_error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    created_at: Mapped[DateTime] = mapped_column(DateTime, default=func.now())
+    sent_at: Mapped[Optional[DateTime]] = mapped_column(DateTime, nullable=True)
@@ -1,23 +1,50 @@
 import logging
-from typing import Dict, Optional, List
-from sqlalchemy import select, update, delete
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, NamedTuple, Optional, List, Sequence, Tuple
+from sqlalchemy import select, update, delete, insert, func, literal, or_, Row
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 
-from app.database.models import ActiveUser, User, Material, Theme, News, Admin
+from app.database.models import utcnow, ActiveUser, User, Material, Theme, News, Admin, BroadcastJob, BroadcastDelivery, \
+    CategoryTheme, FSMRecord, VerificationToken, OutboxEmail
 
 logger = logging.getLogger(__name__)
 
-async def orm_AddActiveUser(session: AsyncSession, data: Dict) -> Optional[ActiveUser]:
-    """Добавляет нового активного пользователя и обновляет reg_status."""
+
+# Письмо с таким статусом больше не отправляется
+FINAL_EMAIL_STATUSES = ("sent", "failed")
+
+
+class Page(NamedTuple):
+    """Страница пагинации: элементы и наличие соседних страниц."""
+    items: Sequence[Any]
+    page: int
+    has_prev: bool
+    has_next: bool
+
+
+def _dialect_insert(session: AsyncSession, model):
+    """INSERT с поддержкой ON CONFLICT для диалекта текущей базы (SQLite или PostgreSQL)."""
+    if session.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+async def orm_register_user(session: AsyncSession, data: Dict) -> bool:
+    """Регистрирует пользователя одной транзакцией: upsert ActiveUser и reg_status=True.
+
+    Повторный вызов (двойное нажатие на последнем шаге) только обновляет анкету.
+    """
+    user_id = data["user_id"]
     try:
-        user = await session.get(User, data["user_id"])
-        if not user:
-            raise ValueError(f"Пользователь user_id={data['user_id']} не найден в таблице User")
+        result = await session.execute(update(User).where(User.user_id == user_id).values(reg_status=True))
+        if result.rowcount == 0:
+            await session.rollback()
+            logger.warning(f"Пользователь user_id={user_id} не найден в user")
+            return False
 
-        user_data = {
-            "user_id": data["user_id"],
+        profile = {
             "name": data["name_user"],
             "school": data["school"],
             "phone_number": data["phone_number"],
@@ -25,20 +52,15 @@ async def orm_AddActiveUser(session: AsyncSession, data: Dict) -> Optional[Activ
             "name_mentor": data["name_mentor"],
             "post_mentor": data.get("post_mentor", "")
         }
-        active_user = ActiveUser(**user_data)
-        session.add(active_user)
-        user.reg_status = True
+        stmt = _dialect_insert(session, ActiveUser).values(user_id=user_id, **profile)
+        await session.execute(stmt.on_conflict_do_update(index_elements=[ActiveUser.user_id], set_=profile))
         await session.commit()
-        logger.info(f"Пользователь user_id={data['user_id']} добавлен в active_user")
-        return active_user
+        logger.info(f"Пользователь user_id={user_id} зарегистрирован")
+        return True
     except SQLAlchemyError as e:
         await session.rollback()
-        logger.error(f"Ошибка базы данных при добавлении active_user user_id={data.get('user_id')}: {e}")
-        return None
-    except Exception as e:
-        await session.rollback()
-        logger.error(f"Ошибка добавления active_user user_id={data.get('user_id')}: {e}")
-        return None
+        logger.error(f"Ошибка базы данных при регистрации user_id={user_id}: {e}")
+        return False
 
 async def orm_AddUser(session: AsyncSession, data: Dict) -> Optional[User]:
     """Добавляет пользователя в базу данных."""
@@ -57,26 +79,99 @@ async def orm_AddUser(session: AsyncSession, data: Dict) -> Optional[User]:
         logger.error(f"Ошибка базы данных при добавлении user_id={data.get('user_id')}: {e}")
         return None
 
-async def orm_get_all_user(session: AsyncSession) -> List[int]:
-    """Возвращает список всех user_id из таблицы User."""
+async def orm_ensure_user(session: AsyncSession, user_id: int, nickname: str) -> Optional[str]:
+    """Заводит пользователя, если его нет, и возвращает ФИО из анкеты (None - не зарегистрирован).
+
+    Одна транзакция: INSERT ... ON CONFLICT (заодно снимает отметку недоступности с вернувшегося
+    пользователя) и выборка одного столбца active_user без загрузки связей.
+    Ошибки базы пробрасываются: /start сообщает о них пользователю.
+    """
     try:
-        query = select(User.user_id)
-        result = await session.execute(query)
-        users = result.scalars().all()
-        logger.debug(f"Получено {len(users)} пользователей из user")
-        return users
+        stmt = _dialect_insert(session, User).values(user_id=user_id, nickname=nickname, reg_status=False, unreachable=False)
+        await session.execute(stmt.on_conflict_do_update(
+            index_elements=[User.user_id],
+            set_={"unreachable": False, "unreachable_reason": None},
+            where=User.unreachable.is_(True),
+        ))
+        result = await session.execute(select(ActiveUser.name).where(ActiveUser.user_id == user_id))
+        name = result.scalar_one_or_none()
+        await session.commit()
+        return name
     except SQLAlchemyError as e:
-        logger.error(f"Ошибка базы данных при получении списка пользователей: {e}")
-        return []
+        await session.rollback()
+        logger.error(f"Ошибка базы данных при /start user_id={user_id}: {e}")
+        raise
+
+async def orm_get_user_status(session: AsyncSession, user_id: int) -> Optional[Row]:
+    """Возвращает (unreachable, name) пользователя одним запросом без записи (None - пользователя нет).
+
+    name - ФИО из анкеты, None у незарегистрированного. Ошибки базы пробрасываются, как в orm_ensure_user.
+    """
+    try:
+        query = (
+            select(User.unreachable, ActiveUser.name)
+            .outerjoin(ActiveUser, ActiveUser.user_id == User.user_id)
+            .where(User.user_id == user_id)
+        )
+        return (await session.execute(query)).first()
+    except SQLAlchemyError as e:
+        logger.error(f"Ошибка базы данных при проверке статуса user_id={user_id}: {e}")
+        raise
+
+def _user_ids_after_query(after: int, limit: int, reachable_only: bool = False):
+    """Запрос следующей страницы user_id по первичному ключу (keyset-пагинация)."""
+    query = select(User.user_id).where(User.user_id > after)
+    if reachable_only:
+        query = query.where(User.unreachable.isnot(True))
+    return query.order_by(User.user_id).limit(limit)
+
+async def orm_iter_user_ids(session: AsyncSession, chunk_size: int = 1000,
+                            reachable_only: bool = False) -> AsyncIterator[List[int]]:
+    """Потоково отдает user_id порциями не больше chunk_size, не загружая таблицу целиком.
+
+    Используется для прогрева индекса известных пользователей. Рассылки идут по тому же
+    keyset-запросу (_user_ids_after_query), но переносят порцию в broadcast_delivery
+    одним INSERT ... SELECT, не поднимая user_id в Python.
+    """
+    after = 0
+    while True:
+        try:
+            result = await session.execute(_user_ids_after_query(after, chunk_size, reachable_only))
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка базы данных при выборке пользователей после user_id={after}: {e}")
+            return
+        chunk = result.scalars().all()
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        after = chunk[-1]
+
+async def orm_mark_unreachable(session: AsyncSession, reasons: Dict[int, str]) -> None:
+    """Помечает пользователей недоступными для рассылок с указанием причины."""
+    try:
+        for reason in set(reasons.values()):
+            user_ids = [user_id for user_id, r in reasons.items() if r == reason]
+            await session.execute(
+                update(User)
+                .where(User.user_id.in_(user_ids))
+                .values(unreachable=True, unreachable_reason=reason)
+            )
+        await session.commit()
+        logger.info(f"Помечено недоступными {len(reasons)} пользователей")
+    except SQLAlchemyError as e:
+        await session.rollback()
+        logger.error(f"Ошибка базы данных при отметке недоступных пользователей: {e}")
 
 async def orm_Change_RegStaus(session: AsyncSession, user_id: int, new_reg_status: bool) -> bool:
     """Изменяет статус регистрации пользователя и управляет ActiveUser."""
     try:
-        user = await session.get(User, user_id)
-        if not user:
+        result = await session.execute(update(User).where(User.user_id == user_id).values(reg_status=new_reg_status))
+        if result.rowcount == 0:
+            await session.rollback()
             logger.warning(f"Пользователь user_id={user_id} не найден в user")
             return False
-        user.reg_status = new_reg_status
         if not new_reg_status:
             await session.execute(
                 delete(ActiveUser).where(ActiveUser.user_id == user_id)
@@ -92,8 +187,8 @@ async def orm_Change_RegStaus(session: AsyncSession, user_id: int, new_reg_statu
 async def orm_Check_avail_user(session: AsyncSession, user_id: int) -> bool:
     """Проверяет, существует ли пользователь с указанным user_id."""
     try:
-        result = await session.get(User, user_id)
-        return bool(result)
+        result = await session.execute(select(User.user_id).where(User.user_id == user_id))
+        return result.first() is not None
     except SQLAlchemyError as e:
         logger.error(f"Ошибка базы данных при проверке user_id={user_id}: {e}")
         return False
@@ -101,8 +196,8 @@ async def orm_Check_avail_user(session: AsyncSession, user_id: int) -> bool:
 async def orm_Check_register_user(session: AsyncSession, user_id: int) -> Optional[str]:
     """Проверяет, зарегистрирован ли пользователь как активный."""
     try:
-        result = await session.get(ActiveUser, user_id)
-        return result.name if result else None
+        result = await session.execute(select(ActiveUser.name).where(ActiveUser.user_id == user_id))
+        return result.scalar_one_or_none()
     except SQLAlchemyError as e:
         logger.error(f"Ошибка базы данных при проверке регистрации user_id={user_id}: {e}")
         return None
@@ -180,6 +275,17 @@ async def orm_get_news_by_id(session: AsyncSession, id: int) -> Optional[News]:
         logger.error(f"Ошибка базы данных при получении новости id={id}: {e}")
         return None
 
+async def orm_get_news_page(session: AsyncSession, page: int, per_page: int = 1) -> Page:
+    """Возвращает страницу новостей (с 1) одним запросом: LIMIT per_page + 1 показывает, есть ли следующая."""
+    try:
+        query = select(News).order_by(News.id).offset((page - 1) * per_page).limit(per_page + 1)
+        result = await session.execute(query)
+        news = result.scalars().all()
+        return Page(news[:per_page], page, page > 1, len(news) > per_page)
+    except SQLAlchemyError as e:
+        logger.error(f"Ошибка базы данных при получении страницы новостей page={page}: {e}")
+        return Page([], page, page > 1, False)
+
 async def orm_edit_news_by_id(session: AsyncSession, post_id: int, text: str = None, photo: str = None) -> bool:
     """Редактирует новость по её идентификатору."""
     try:
@@ -245,4 +351,413 @@ async def orm_get_material_by_id(session: AsyncSession, material_id: int) -> Lis
         return result.scalars().all()
     except SQLAlchemyError as e:
         logger.error(f"Ошибка базы данных при получении материалов material_id={material_id}: {e}")
-        return []
\ No newline at end of file
+        return []
+
+async def orm_get_all_categories(session: AsyncSession) -> List[Row]:
+    """Возвращает (id, title) всех категорий тем без загрузки связанных тем."""
+    try:
+        query = select(CategoryTheme.id, CategoryTheme.title).order_by(CategoryTheme.id)
+        result = await session.execute(query)
+        return result.all()
+    except SQLAlchemyError as e:
+        logger.error(f"Ошибка базы данных при получении категорий тем: {e}")
+        return []
+
+async def orm_get_all_themes(session: AsyncSession) -> List[Row]:
+    """Возвращает (id, title, technique, category_id) всех тем без загрузки категорий."""
+    try:
+        query = select(Theme.id, Theme.title, Theme.technique, Theme.category_id).order_by(Theme.id)
+        result = await session.execute(query)
+        return result.all()
+    except SQLAlchemyError as e:
+        logger.error(f"Ошибка базы данных при получении тем: {e}")
+        return []
+
+async def orm_get_all_materials(session: AsyncSession) -> List[Row]:
+    """Возвращает (id, title, link) всех материалов."""
+    try:
+        query = select(Material.id, Material.title, Material.link).order_by(Material.id)
+        result = await session.execute(query)
+        return result.all()
+    except SQLAlchemyError as e:
+        logger.error(f"Ошибка базы данных при получении материалов: {e}")
+        return []
+
+async def orm_create_broadcast_job(session: AsyncSession, kind: str, text: str = None,
+                                   from_chat_id: int = None, message_id: int = None) -> Optional[BroadcastJob]:
+    """Создает задачу рассылки."""
+    try:
+        job = BroadcastJob(kind=kind, text=text, from_chat_id=from_chat_id, message_id=message_id,
+                           status="running", cursor=0, sent=0, failed=0)
+        session.add(job)
+        await session.commit()
+        logger.info(f"Создана задача рассылки id={job.id} kind={kind}")
+        return job
+    except SQLAlchemyError as e:
+        await session.rollback()
+        logger.error(f"Ошибка базы данных при создании задачи рассылки kind={kind}: {e}")
+        return None
+
+async def orm_create_broadcast_job_once(session: AsyncSession, kind: str, since: datetime, dedup_key: str,
+                                        text: str = None) -> Optional[BroadcastJob]:
+    """Создает рассылку вида kind, если начиная с since такой не было (None - уже была).
+
+    Проверка и вставка идут одной транзакцией (в очереди записи SQLite - под BEGIN IMMEDIATE),
+    а одновременную вставку из другого процесса отсекает уникальный dedup_key.
+    """
+    try:
+        if await orm_has_recent_broadcast_job(session, kind, since):
+            await session.rollback()
+            return None
+        job = BroadcastJob(kind=kind, text=text, status="running", cursor=0, sent=0, failed=0, dedup_key=dedup_key)
+        session.add(job)
+        await session.commit()
+        logger.info(f"Создана задача рассылки id={job.id} kind={kind}")
+        return job
+    except IntegrityError:
+        await session.rollback()
+        logger.info(f"Рассылку kind={kind} с ключом {dedup_key} уже создал другой процесс")
+        return None
+    except SQLAlchemyError as e:
+        await session.rollback()
+        logger.error(f"Ошибка базы данных при создании задачи рассылки kind={kind}: {e}")
+        return None
+
+async def orm_get_broadcast_job(session: AsyncSession, job_id: int) -> Optional[BroadcastJob]:
+    """Возвращает задачу рассылки по идентификатору."""
+    try:
+        return await session.get(BroadcastJob, job_id)
+    except SQLAlchemyError as e:
+        logger.error(f"Ошибка базы данных при получении задачи рассылки id={job_id}: {e}")
+        return None
+
+async def orm_has_recent_broadcast_job(session: AsyncSession, kind: str, since: datetime) -> bool:
+    """Проверяет, создавалась ли рассылка указанного вида начиная с момента since."""
+    try:
+        query = (
+            select(BroadcastJob.id)
+            .where(BroadcastJob.kind == kind, BroadcastJob.created_at >= since)
+            .limit(1)
+        )
+        result = await session.execute(query)
+        return result.scalar() is not None
+    except SQLAlchemyError as e:
+        logger.error(f"Ошибка базы данных при поиске недавней рассылки kind={kind}: {e}")
+        return False
+
+async def orm_get_unfinished_broadcast_jobs(session: AsyncSession) -> List[int]:
+    """Возвращает идентификаторы незавершенных задач рассылки."""
+    try:
+        query = select(BroadcastJob.id).where(BroadcastJob.status == "running").order_by(BroadcastJob.id)
+        result = await session.execute(query)
+        return result.scalars().all()
+    except SQLAlchemyError as e:
+        logger.error(f"Ошибка базы данных при получении незавершенных рассылок: {e}")
+        return []
+
+async def orm_acquire_broadcast_job(session: AsyncSession, job_id: int, owner: str,
+                                    now: datetime, lease_until: datetime) -> bool:
+    """Закрепляет незавершенную рассылку за процессом owner до lease_until.
+
+    Условный UPDATE: задачу получает один процесс, пока его аренда не истекла. Свою же
+    задачу (owner совпадает, например после перезапуска) процесс забирает сразу.
+    """
+    try:
+        result = await session.execute(
+            update(BroadcastJob)
+            .where(
+                BroadcastJob.id == job_id,
+                BroadcastJob.status == "running",
+                or_(
+                    BroadcastJob.claimed_by.is_(None),
+                    BroadcastJob.claimed_by == owner,
+                    BroadcastJob.lease_until.is_(None),
+                    BroadcastJob.lease_until < now,
+                ),
+            )
+            .values(claimed_by=owner, lease_until=lease_until)
+            .returning(BroadcastJob.id)
+        )
+        acquired = result.scalar() is not None
+        await session.commit()
+        return acquired
+    except SQLAlchemyError as e:
+        await session.rollback()
+        logger.error(f"Ошибка базы данных при захвате рассылки id={job_id}: {e}")
+        return False
+
+async def orm_claim_broadcast_chunk(session: AsyncSession, job_id: int, limit: int, owner: str,
+                                    lease_until: datetime) -> Optional[List[int]]:
+    """Продлевает аренду рассылки и берет в работу следующую порцию получателей.
+
+    Сначала возвращаются получатели, взятые до перезапуска и не отмеченные,
+    затем следующие user_id после курсора задачи. None - задачу забрал другой процесс.
+    """
+    try:
+        renewed = await session.execute(
+            update(BroadcastJob)
+            .where(BroadcastJob.id == job_id, BroadcastJob.status == "running", BroadcastJob.claimed_by == owner)
+            .values(lease_until=lease_until)
+            .returning(BroadcastJob.id)
+        )
+        if renewed.scalar() is None:
+            await session.rollback()
+            return None
+
+        query = (
+            select(BroadcastDelivery.user_id)
+            .where(BroadcastDelivery.job_id == job_id, BroadcastDelivery.status == "pending")
+            .order_by(BroadcastDelivery.user_id)
+            .limit(limit)
+        )
+        pending = (await session.execute(query)).scalars().all()
+        if pending:
+            await session.commit()
+            return pending
+
+        # Порция переносится в broadcast_delivery одним INSERT ... SELECT ... RETURNING,
+        # без передачи user_id из базы в Python и обратно
+        cursor = select(BroadcastJob.cursor).where(BroadcastJob.id == job_id).scalar_subquery()
+        chunk = _user_ids_after_query(cursor, limit, reachable_only=True).subquery()
+        result = await session.execute(
+            insert(BroadcastDelivery)
+            .from_select(["job_id", "user_id", "status"], select(literal(job_id), chunk.c.user_id, literal("pending")))
+            .returning(BroadcastDelivery.user_id)
+        )
+        user_ids = sorted(result.scalars().all())
+        if user_ids:
+            await session.execute(update(BroadcastJob).where(BroadcastJob.id == job_id).values(cursor=user_ids[-1]))
+        await session.commit()
+        return user_ids
+    except SQLAlchemyError as e:
+        await session.rollback()
+        logger.error(f"Ошибка базы данных при выборке получателей рассылки id={job_id}: {e}")
+        raise
+
+async def orm_mark_broadcast_chunk(session: AsyncSession, job_id: int,
+                                   delivered: List[int], failed: List[int]) -> None:
+    """Отмечает доставленные и недоставленные сообщения порции одним коммитом."""
+    try:
+        for status, user_ids in (("sent", delivered), ("failed", failed)):
+            if user_ids:
+                await session.execute(
+                    update(BroadcastDelivery)
+                    .where(BroadcastDelivery.job_id == job_id, BroadcastDelivery.user_id.in_(user_ids))
+                    .values(status=status)
+                )
+        await session.execute(
+            update(BroadcastJob)
+            .where(BroadcastJob.id == job_id)
+            .values(sent=BroadcastJob.sent + len(delivered), failed=BroadcastJob.failed + len(failed))
+        )
+        await session.commit()
+    except SQLAlchemyError as e:
+        await session.rollback()
+        logger.error(f"Ошибка базы данных при отметке доставки рассылки id={job_id}: {e}")
+        raise
+
+async def orm_finish_broadcast_job(session: AsyncSession, job_id: int, owner: str) -> None:
+    """Помечает задачу рассылки завершенной, если она все еще за процессом owner."""
+    try:
+        await session.execute(
+            update(BroadcastJob)
+            .where(BroadcastJob.id == job_id, BroadcastJob.claimed_by == owner)
+            .values(status="done", finished_at=utcnow(), claimed_by=None, lease_until=None)
+        )
+        await session.commit()
+    except SQLAlchemyError as e:
+        await session.rollback()
+        logger.error(f"Ошибка базы данных при завершении рассылки id={job_id}: {e}")
+
+async def orm_release_broadcast_job(session: AsyncSession, job_id: int, owner: str) -> None:
+    """Снимает аренду незавершенной рассылки с процесса owner: ее сразу может продолжить другой процесс."""
+    try:
+        await session.execute(
+            update(BroadcastJob)
+            .where(BroadcastJob.id == job_id, BroadcastJob.status == "running", BroadcastJob.claimed_by == owner)
+            .values(claimed_by=None, lease_until=None)
+        )
+        await session.commit()
+    except SQLAlchemyError as e:
+        await session.rollback()
+        logger.error(f"Ошибка базы данных при освобождении рассылки id={job_id}: {e}")
+
+async def orm_get_fsm_record(session: AsyncSession, key: str) -> Optional[Row]:
+    """Возвращает (state, data) сохраненного состояния FSM. Ошибки пробрасываются, чтобы не принять их за пустое состояние."""
+    try:
+        result = await session.execute(select(FSMRecord.state, FSMRecord.data).where(FSMRecord.key == key))
+        return result.first()
+    except SQLAlchemyError as e:
+        logger.error(f"Ошибка базы данных при чтении состояния FSM key={key}: {e}")
+        raise
+
+async def orm_save_fsm_records(session: AsyncSession, records: Dict[str, Tuple[Optional[str], Optional[str]]]) -> bool:
+    """Сохраняет состояния FSM одной транзакцией. Запись с data=None удаляется."""
+    try:
+        removed = [key for key, (state, data) in records.items() if data is None]
+        if removed:
+            await session.execute(delete(FSMRecord).where(FSMRecord.key.in_(removed)))
+        rows = [
+            {"key": key, "state": state, "data": data}
+            for key, (state, data) in records.items() if data is not None
+        ]
+        if rows:
+            # Upsert, а не DELETE + INSERT: два процесса, сохраняющие один ключ, не упрутся в первичный ключ
+            stmt = _dialect_insert(session, FSMRecord)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[FSMRecord.key],
+                set_={"state": stmt.excluded.state, "data": stmt.excluded.data, "updated_at": func.now()},
+            )
+            await session.execute(stmt, rows)
+        await session.commit()
+        return True
+    except SQLAlchemyError as e:
+        await session.rollback()
+        logger.error(f"Ошибка базы данных при сохранении {len(records)} состояний FSM: {e}")
+        return False
+
+async def orm_put_verification_token(session: AsyncSession, user_id: int, token: str, expires_at: datetime) -> bool:
+    """Сохраняет код подтверждения пользователя, заменяя предыдущий."""
+    try:
+        stmt = _dialect_insert(session, VerificationToken).values(user_id=user_id, token=token, expires_at=expires_at)
+        await session.execute(stmt.on_conflict_do_update(
+            index_elements=[VerificationToken.user_id],
+            set_={"token": stmt.excluded.token, "expires_at": stmt.excluded.expires_at},
+        ))
+        await session.commit()
+        return True
+    except SQLAlchemyError as e:
+        await session.rollback()
+        logger.error(f"Ошибка базы данных при сохранении кода подтверждения user_id={user_id}: {e}")
+        return False
+
+async def orm_consume_verification_token(session: AsyncSession, user_id: int, token: str, now: datetime) -> bool:
+    """Проверяет и удаляет действующий код одним DELETE: код нельзя использовать дважды даже из разных процессов."""
+    try:
+        result = await session.execute(
+            delete(VerificationToken)
+            .where(
+                VerificationToken.user_id == user_id,
+                VerificationToken.token == token,
+                VerificationToken.expires_at > now,
+            )
+        )
+        await session.commit()
+        return result.rowcount == 1
+    except SQLAlchemyError as e:
+        await session.rollback()
+        logger.error(f"Ошибка базы данных при проверке кода подтверждения user_id={user_id}: {e}")
+        return False
+
+async def orm_purge_verification_tokens(session: AsyncSession, now: datetime) -> int:
+    """Удаляет истекшие коды подтверждения и возвращает их число."""
+    try:
+        result = await session.execute(delete(VerificationToken).where(VerificationToken.expires_at <= now))
+        await session.commit()
+        return result.rowcount
+    except SQLAlchemyError as e:
+        await session.rollback()
+        logger.error(f"Ошибка базы данных при очистке кодов подтверждения: {e}")
+        return 0
+
+async def orm_enqueue_email(session: AsyncSession, user_id: Optional[int], recipient: str, subject: str,
+                            body: str, now: datetime) -> Optional[int]:
+    """Ставит письмо в очередь отправки и возвращает его ID."""
+    try:
+        email = OutboxEmail(
+            user_id=user_id,
+            recipient=recipient,
+            domain=recipient.rsplit("@", 1)[-1].lower(),
+            subject=subject,
+            body=body,
+            next_attempt_at=now,
+        )
+        session.add(email)
+        await session.commit()
+        return email.id
+    except SQLAlchemyError as e:
+        await session.rollback()
+        logger.error(f"Ошибка базы данных при постановке письма на {recipient} в очередь: {e}")
+        return None
+
+async def orm_claim_due_email(session: AsyncSession, now: datetime, lease_until: datetime,
+                              exclude_domains: Sequence[str] = ()) -> Optional[OutboxEmail]:
+    """Берет в работу одно письмо, которое пора отправлять.
+
+    Письмо помечается sending до lease_until условным UPDATE, поэтому его не возьмет другой воркер
+    или процесс. Если процесс упал во время отправки, после lease_until письмо возьмут снова.
+    """
+    try:
+        query = (
+            select(OutboxEmail.id)
+            .where(OutboxEmail.status.in_(("pending", "sending")), OutboxEmail.next_attempt_at <= now)
+            .order_by(OutboxEmail.next_attempt_at)
+            .limit(10)
+        )
+        if exclude_domains:
+            query = query.where(OutboxEmail.domain.not_in(exclude_domains))
+        for email_id in (await session.execute(query)).scalars().all():
+            result = await session.execute(
+                update(OutboxEmail)
+                .where(
+                    OutboxEmail.id == email_id,
+                    OutboxEmail.status.in_(("pending", "sending")),
+                    OutboxEmail.next_attempt_at <= now,
+                )
+                .values(status="sending", next_attempt_at=lease_until)
+            )
+            if result.rowcount == 1:
+                await session.commit()
+                return await session.get(OutboxEmail, email_id)
+        await session.commit()
+        return None
+    except SQLAlchemyError as e:
+        await session.rollback()
+        logger.error(f"Ошибка базы данных при выборке писем для отправки: {e}")
+        return None
+
+async def orm_finish_email(session: AsyncSession, email_id: int, status: str, attempts: int,
+                           error: Optional[str] = None, next_attempt_at: Optional[datetime] = None) -> None:
+    """Записывает результат попытки: sent, failed или pending с временем следующей попытки.
+
+    У отправленного или окончательно не отправленного письма текст стирается: в нем код подтверждения.
+    """
+    try:
+        values = {"status": status, "attempts": attempts, "last_error": error}
+        if next_attempt_at is not None:
+            values["next_attempt_at"] = next_attempt_at
+        if status in FINAL_EMAIL_STATUSES:
+            values["body"] = ""
+        if status == "sent":
+            values["sent_at"] = func.now()
+        await session.execute(update(OutboxEmail).where(OutboxEmail.id == email_id).values(**values))
+        await session.commit()
+    except SQLAlchemyError as e:
+        await session.rollback()
+        logger.error(f"Ошибка базы данных при обновлении письма id={email_id}: {e}")
+
+async def orm_scrub_finished_emails(session: AsyncSession) -> int:
+    """Стирает текст писем, которые уже не будут отправляться, и возвращает их число."""
+    try:
+        result = await session.execute(
+            update(OutboxEmail)
+            .where(OutboxEmail.status.in_(FINAL_EMAIL_STATUSES), OutboxEmail.body != "")
+            .values(body="")
+        )
+        await session.commit()
+        return result.rowcount
+    except SQLAlchemyError as e:
+        await session.rollback()
+        logger.error(f"Ошибка базы данных при очистке текста отправленных писем: {e}")
+        return 0
+
+async def orm_get_email_status(session: AsyncSession, email_id: int) -> Optional[Row]:
+    """Возвращает статус письма из очереди: status, attempts, last_error, sent_at."""
+    try:
+        query = select(
+            OutboxEmail.status, OutboxEmail.attempts, OutboxEmail.last_error, OutboxEmail.sent_at
+        ).where(OutboxEmail.id == email_id)
+        return (await session.execute(query)).first()
+    except SQLAlchemyError as e:
+        logger.error(f"Ошибка базы данных при получении статуса письма id={email_id}: {e}")
+        return None
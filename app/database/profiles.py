@@ -0,0 +1,67 @@
+import logging
+from typing import Any, Dict
+
+from sqlalchemy import event, make_url
+from sqlalchemy.engine import URL
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+logger = logging.getLogger(__name__)
+
+# Выполняются на каждом новом соединении SQLite
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",  # Читатели не блокируют писателя и наоборот
+    "PRAGMA synchronous=NORMAL",  # В режиме WAL безопасно и без fsync на каждый коммит
+    "PRAGMA busy_timeout=5000",  # Ждать блокировку до 5 с вместо мгновенного "database is locked"
+    "PRAGMA cache_size=-20000",  # Кэш страниц ~20 МБ на соединение
+    "PRAGMA mmap_size=268435456",  # Чтение файла базы через mmap, до 256 МБ
+    "PRAGMA temp_store=MEMORY",  # Временные таблицы и индексы в памяти
+)
+
+
+def _is_memory_sqlite(url: URL) -> bool:
+    return url.database in (None, "", ":memory:") or "mode=memory" in str(url)
+
+
+def engine_options(url: str) -> Dict[str, Any]:
+    """Параметры create_async_engine для базы по ее URL."""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend == "sqlite":
+        if _is_memory_sqlite(parsed):
+            # Одна база в памяти существует, пока открыто ее соединение
+            return {"poolclass": StaticPool, "connect_args": {"check_same_thread": False}}
+        # Запись в SQLite все равно идет по одной, а в WAL читатели работают параллельно:
+        # хватает небольшого пула, проверка соединений локального файла не нужна
+        return {"pool_size": 5, "max_overflow": 5, "pool_timeout": 30, "pool_pre_ping": False,
+                "query_cache_size": 500}
+    if backend == "postgresql":
+        return {
+            "pool_size": 20,  # Постоянные соединения
+            "max_overflow": 10,  # Дополнительные соединения при пиках
+            "pool_timeout": 30,  # Ожидание свободного соединения (в секундах)
+            "pool_pre_ping": True,  # Соединение могло быть закрыто сервером или прокси
+            "pool_recycle": 1800,  # Переоткрывать соединения раз в 30 минут
+            "query_cache_size": 500,
+        }
+    return {"pool_pre_ping": True, "query_cache_size": 500}
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
+
+def create_engine_for(url: str, **overrides: Any) -> AsyncEngine:
+    """Создает движок с профилем, подобранным по URL (SQLite или PostgreSQL)."""
+    options = engine_options(url)
+    options.update(overrides)
+    engine = create_async_engine(url, **options)
+    if engine.dialect.name == "sqlite" and not _is_memory_sqlite(engine.url):
+        event.listen(engine.sync_engine, "connect", _apply_sqlite_pragmas)
+    logger.info(f"Движок базы {engine.dialect.name}: {options}")
+    return engine
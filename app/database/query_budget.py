@@ -0,0 +1,80 @@
+import logging
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Deque, Iterator, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Горячий путь выполнил больше SQL-запросов, чем ему разрешено."""
+
+
+class QueryCounter:
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.statements: List[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+
+_current: ContextVar[Optional[QueryCounter]] = ContextVar("query_budget", default=None)
+# Управление транзакцией - не запросы горячего пути (BEGIN IMMEDIATE и точки сохранения добавляет очередь записи)
+_TRANSACTION_PREFIXES = ("BEGIN", "SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK TO SAVEPOINT")
+_strict = False
+# Последние превышения бюджета: обработчики перехватывают исключения, а тест может проверить этот список
+violations: Deque[str] = deque(maxlen=100)
+
+
+def install_query_budget(engine: AsyncEngine, strict: bool = False) -> None:
+    """Подключает подсчет запросов к движку. strict=True - превышение бюджета бросает QueryBudgetExceeded."""
+    global _strict
+    _strict = strict
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        counter = _current.get()
+        if counter is not None and not statement.startswith(_TRANSACTION_PREFIXES):
+            counter.statements.append(statement)
+
+
+def current_counter() -> Optional[QueryCounter]:
+    """Счетчик блока query_budget, в котором выполняется код (None - вне блока)."""
+    return _current.get()
+
+
+@contextmanager
+def counting_into(counter: Optional[QueryCounter]) -> Iterator[None]:
+    """Засчитывает запросы блока в чужой счетчик: так очередь записи считает операции в бюджет вызвавшего их кода."""
+    token = _current.set(counter)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def query_budget(name: str, limit: int) -> Iterator[QueryCounter]:
+    """Считает SQL-запросы внутри блока и сообщает, если их больше limit.
+
+    Без install_query_budget счетчик остается пустым, поэтому в обычном режиме блок ничего не стоит.
+    """
+    counter = QueryCounter(name, limit)
+    token = _current.set(counter)
+    try:
+        yield counter
+    finally:
+        _current.reset(token)
+    if counter.count > limit:
+        message = f"{name}: {counter.count} SQL-запросов при бюджете {limit}:\n" + "\n".join(counter.statements)
+        violations.append(message)
+        if _strict:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
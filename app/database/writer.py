@@ -0,0 +1,220 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, NamedTuple, Optional, TypeVar
+
+from sqlalchemy import event, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, AsyncSessionTransaction, async_sessionmaker
+
+from app.database.profiles import create_engine_for
+from app.database.query_budget import QueryCounter, counting_into, current_counter
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class _BatchSession(AsyncSession):
+    """Сессия пакета записи: orm-функции не завершают общую транзакцию сами.
+
+    commit() операции только отправляет ее изменения в базу, rollback() откатывает
+    точку сохранения этой операции, не трогая остальные операции пакета.
+    """
+
+    savepoint: Optional[AsyncSessionTransaction] = None
+
+    def in_savepoint(self) -> bool:
+        """Точка сохранения операции еще открыта (в том числе после ошибки flush, когда она неактивна)."""
+        return self.savepoint is not None and self.sync_session.get_nested_transaction() is self.savepoint.sync_transaction
+
+    async def commit(self) -> None:
+        await self.flush()
+
+    async def rollback(self) -> None:
+        if self.in_savepoint():
+            await self.savepoint.rollback()
+
+
+class _WriteOp(NamedTuple):
+    op: Callable[..., Awaitable[Any]]
+    args: tuple
+    kwargs: dict
+    future: asyncio.Future
+    counter: Optional[QueryCounter]  # Бюджет запросов вызвавшего кода
+
+
+class WriteQueue:
+    """Единственный писатель с групповым коммитом.
+
+    Обработчики передают orm-функции записи в submit(), фоновая задача собирает их в пакет
+    (до max_batch операций или max_delay секунд) и выполняет одной транзакцией на отдельном
+    соединении: каждая операция в своей точке сохранения, затем один COMMIT. Ошибка одной
+    операции откатывает только ее. Если не удался сам COMMIT, операции пакета выполняются
+    повторно по одной, как без очереди. Чтение идет через обычный пул сессий.
+    """
+
+    def __init__(self, engine: AsyncEngine, max_batch: int = 100, max_delay: float = 0.005):
+        self.engine = engine
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._batch_pool = async_sessionmaker(bind=engine, class_=_BatchSession, expire_on_commit=False)
+        self._single_pool = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+        self._queue: asyncio.Queue[Optional[_WriteOp]] = asyncio.Queue()  # None - остановка
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.batches = 0
+        self.ops = 0
+        self.fallbacks = 0
+
+    @property
+    def running(self) -> bool:
+        """Писатель принимает операции: запущен и close() еще не вызван."""
+        return self._task is not None and not self._task.done() and not self._closing
+
+    async def submit(self, op: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any) -> T:
+        """Ставит op(session, *args, **kwargs) в очередь и возвращает ее результат после COMMIT."""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(_WriteOp(op, args, kwargs, future, current_counter()))
+        return await future
+
+    async def _collect(self) -> List[Optional[_WriteOp]]:
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.max_batch and batch[-1] is not None:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _execute_batch(self, batch: List[_WriteOp]) -> None:
+        results = []
+        try:
+            async with self._batch_pool() as session:
+                for item in batch:
+                    session.savepoint = await session.begin_nested()
+                    try:
+                        with counting_into(item.counter):
+                            result = await item.op(session, *item.args, **item.kwargs)
+                    except Exception as e:
+                        await session.rollback()
+                        results.append((item, None, e))
+                    else:
+                        if session.in_savepoint():
+                            if session.savepoint.is_active:
+                                await session.savepoint.commit()
+                            else:
+                                # Операция перехватила ошибку flush, не откатив свою точку сохранения
+                                await session.savepoint.rollback()
+                        results.append((item, result, None))
+                    finally:
+                        session.savepoint = None
+                await AsyncSession.commit(session)
+        except Exception as e:
+            logger.warning(f"Групповой коммит {len(batch)} операций не удался ({e}), выполняю по одной")
+            self.fallbacks += 1
+            await self._execute_one_by_one(batch)
+            return
+        self.batches += 1
+        self.ops += len(batch)
+        for item, result, error in results:
+            if item.future.done():
+                continue
+            if error is not None:
+                item.future.set_exception(error)
+            else:
+                item.future.set_result(result)
+
+    async def _execute_one_by_one(self, batch: List[_WriteOp]) -> None:
+        for item in batch:
+            if item.future.done():
+                continue
+            try:
+                with counting_into(item.counter):
+                    async with self._single_pool() as session:
+                        result = await item.op(session, *item.args, **item.kwargs)
+            except Exception as e:
+                item.future.set_exception(e)
+            else:
+                item.future.set_result(result)
+
+    async def run(self) -> None:
+        """Разбирает очередь до вызова close()."""
+        while True:
+            batch = await self._collect()
+            stop = batch[-1] is None
+            if stop:
+                batch.pop()
+            if batch:
+                await self._execute_batch(batch)
+            if stop:
+                return
+
+    def start(self) -> asyncio.Task:
+        if not self.running:
+            self._closing = False
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def close(self) -> None:
+        """Останавливает писателя, выполнив уже поставленные операции, и закрывает его соединение."""
+        if self.running:
+            # Метка конца очереди: все, что поставлено раньше, будет выполнено.
+            # Новые вызовы run_write с этого момента пишут в своей сессии
+            self._closing = True
+            self._queue.put_nowait(None)
+            await self._task
+        self._task = None
+        # Операции, поставленные через submit() после метки конца
+        leftover = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                leftover.append(item)
+        if leftover:
+            await self._execute_one_by_one(leftover)
+        await self.engine.dispose()
+        logger.info(f"Очередь записи остановлена: пакетов {self.batches}, операций {self.ops}, "
+                    f"повторов по одной {self.fallbacks}")
+
+
+def create_writer_engine(url: str) -> AsyncEngine:
+    """Движок писателя: одно соединение, для SQLite транзакции начинаются с BEGIN IMMEDIATE."""
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        raise ValueError("Очередь записи не работает с SQLite в памяти: у писателя было бы отдельное соединение и своя база")
+    engine = create_engine_for(url, pool_size=1, max_overflow=0)
+    if engine.dialect.name == "sqlite":
+        @event.listens_for(engine.sync_engine, "connect")
+        def disable_driver_transactions(dbapi_connection, connection_record):
+            # Транзакциями управляет SQLAlchemy: неявный BEGIN драйвера ломает SAVEPOINT
+            dbapi_connection.isolation_level = None
+
+        @event.listens_for(engine.sync_engine, "begin")
+        def begin_immediate(conn):
+            # Блокировка записи берется в начале пакета, а не при первом изменении
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+    return engine
+
+
+_write_queue: Optional[WriteQueue] = None
+
+
+def install_write_queue(url: str, max_batch: int = 100, max_delay: float = 0.005) -> WriteQueue:
+    """Создает очередь записи; run_write начинает ей пользоваться после start()."""
+    global _write_queue
+    _write_queue = WriteQueue(create_writer_engine(url), max_batch=max_batch, max_delay=max_delay)
+    return _write_queue
+
+
+async def run_write(session: AsyncSession, op: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any) -> T:
+    """Выполняет orm-функцию записи через очередь писателя, а если она не запущена - в переданной сессии."""
+    if _write_queue is not None and _write_queue.running:
+        return await _write_queue.submit(op, *args, **kwargs)
+    return await op(session, *args, **kwargs)
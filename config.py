@@ -1,19 +1,69 @@
+import re
+from typing import Optional
 
 from pydantic_settings import BaseSettings
 
 """Модуль настроек для загрузки конфигурации из .env файла с использованием pydantic-settings."""
 
+def asyncpg_url(url: str) -> str:
+    """Приводит URL PostgreSQL вида postgres://... (как его выдают хостинги) к драйверу asyncpg."""
+    scheme, sep, rest = url.partition("://")
+    if scheme in ("postgres", "postgresql") or scheme.startswith("postgresql+"):
+        scheme = "postgresql+asyncpg"
+        # asyncpg не знает libpq-параметр sslmode, у него то же самое называется ssl
+        rest = re.sub(r"([?&])sslmode=", r"\1ssl=", rest)
+    return f"{scheme}{sep}{rest}"
+
+
 class Settings(BaseSettings):
     """Класс для хранения настроек приложения с валидацией."""
     prod: bool = False  # Имя в нижнем регистре, мапится на PROD
     bot_token: str  # Мапится на BOT_TOKEN
     admin_user_nick: str  # Мапится на admin_user_nick
-    db_lite: str  # Мапится на db_lite
+    database_url: Optional[str] = None  # Мапится на DATABASE_URL (PostgreSQL в продакшене), важнее db_lite
+    db_lite: Optional[str] = None  # Мапится на db_lite (SQLite для локального запуска)
     smtp_server: str  # Мапится на SMTP_SERVER
     port: int  # Мапится на PORT
     sender_email: str  # Мапится на sender_email
     sender_password: str  # Мапится на sender_password
+    smtp_pool_size: int = 2  # Сколько SMTP-соединений держать открытыми
+    smtp_idle_timeout: int = 60  # Через сколько секунд простоя SMTP-соединение закрывается
+    mail_workers: int = 4  # Воркеров очереди исходящих писем
+    mail_per_domain: int = 2  # Одновременно отправляемых писем на один почтовый домен
+    mail_max_attempts: int = 6  # Попыток отправки письма до отказа
     news_channel_url: str = "https://t.me/RepinNews"
+    news_page_ttl: int = 60  # Сколько секунд процесс показывает закэшированную страницу новостей
+    startup_notify: bool = True  # Рассылать ли сообщение о запуске бота
+    startup_notify_window: int = 3600  # Не повторять сообщение о запуске чаще (в секундах)
+    webhook_base_url: Optional[str] = None  # Публичный адрес бота для режима --webhook (https://example.com)
+    webhook_path: str = "/webhook"  # Путь, на который Telegram присылает апдейты
+    webhook_host: str = "0.0.0.0"  # Адрес aiohttp-сервера вебхука
+    webhook_port: int = 8080  # Порт aiohttp-сервера вебхука
+    webhook_secret: Optional[str] = None  # Секрет X-Telegram-Bot-Api-Secret-Token, по умолчанию выводится из токена бота
+    webhook_max_in_flight: int = 100  # Максимум одновременно обрабатываемых апдейтов
+    max_concurrent_updates: int = 100  # Сколько апдейтов разных пользователей обрабатывается параллельно
+    fsm_storage: str = "db"  # db - состояния FSM хранятся в базе и переживают перезапуск, memory - только в памяти
+    fsm_state_ttl: int = 30 * 24 * 3600  # Через сколько секунд без сообщений FSM-состояние уходит из памяти
+    fsm_max_users: int = 100_000  # Максимум пользователей с FSM-состоянием в памяти
+    fsm_cache_ttl: int = 5  # Сколько секунд FSM-состояние из базы читается из кэша процесса (0 - без кэша)
+    verification_token_store: str = "db"  # db - коды подтверждения почты в базе (для нескольких процессов), memory - в памяти
+    user_status_ttl: int = 3600  # Сколько секунд /start доверяет закэшированному статусу регистрации
+    user_status_max_size: int = 100_000  # Максимум пользователей в кэше статусов
+    query_budget_mode: str = "off"  # off / warn / strict - проверка числа SQL-запросов на горячих путях
+    ttl_sweep_interval: int = 60  # Период фоновой очистки просроченных записей (в секундах)
+    stats_log_interval: int = 300  # Период записи в лог метрик обработки апдейтов (в секундах)
+    write_queue: bool = False  # Запись из обработчиков через одного писателя с групповым коммитом (для SQLite под нагрузкой)
+    write_batch_size: int = 100  # Максимум операций записи в одной транзакции
+    write_batch_delay: float = 0.005  # Сколько секунд писатель ждет следующие операции в пакет
+
+    @property
+    def db_url(self) -> str:
+        """URL базы для SQLAlchemy: DATABASE_URL с драйвером asyncpg или db_lite."""
+        if self.database_url:
+            return asyncpg_url(self.database_url)
+        if self.db_lite:
+            return self.db_lite
+        raise ValueError("Не задан адрес базы: укажите DATABASE_URL или db_lite")
 
     model_config = {
         "env_file": ".env",
@@ -1,32 +1,47 @@
 import argparse
 import asyncio
 import logging
-from typing import List
+from datetime import timedelta
+from time import time
+from typing import Set, Union
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
-from sqlalchemy import select
 from sqlalchemy.exc import SQLAlchemyError
 
+from app.bot.common.broadcast import (
+    spawn_broadcast_job, resume_broadcast_jobs, resume_broadcast_jobs_periodically, stop_broadcast_jobs
+)
+from app.bot.common.known_users import known_users
+from app.bot.common.user_status import user_status
+from app.bot.common.ttl_store import BoundedMemoryStorage, sweep_periodically
+from app.bot.FSM.storage import SQLAlchemyStorage
+from app.bot.common.token_store import purge_tokens_periodically
+from app.bot.common.verif_mail import token_store, smtp_pool, mail_outbox
 from app.bot.handlers.news_channel import news_channel_router
+from app.bot.webhook import run_webhook
 from app.bot.middlewares.db import DataBaseSession
+from app.bot.middlewares.fsm_flush import FSMFlushMiddleware
+from app.bot.middlewares.ordering import UserEventIsolation, UserOrderingMiddleware
 
-from app.database.engine import create_db, drop_db, session_maker
+from app.database.engine import create_db, drop_db, session_maker, write_queue
+from app.database.query_budget import query_budget
+from app.database.writer import run_write
 
 
 from app.bot.handlers.user_private import user_private_router
 
 from aiogram.filters import CommandStart, Command
 from aiogram.fsm.context import FSMContext
-from aiogram.types import BotCommandScopeAllPrivateChats, Message, ReplyKeyboardRemove
+from aiogram.types import BotCommandScopeAllPrivateChats, Message
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.bot.FSM.FSM_user_private import User_MainStates
-from app.database.models import User
 
 from config import settings
 
-from app.database.orm_query import orm_Check_avail_user, orm_AddUser, orm_Check_register_user, orm_get_all_user
+from app.database.orm_query import orm_create_broadcast_job, orm_create_broadcast_job_once
+from app.database.models import utcnow
 from app.kbds import reply
 
 
@@ -37,81 +52,152 @@ from app.bot.common.bot_cmds_list import private
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
-# Глобальный кэш для user_ids (заполняется при запуске)
-USER_IDS_CACHE: List[int] = []
-
-async def fetch_user_ids(session: AsyncSession) -> List[int]:
-    """Получает список всех user_id из таблицы User."""
-    query = select(User.user_id)
-    result = await session.execute(query)
-    return result.scalars().all()
-
-async def send_message_batch(bot: Bot, user_ids: List[int], message_text: str, batch_size: int = 30) -> None:
-    """Отправляет сообщения партиями с учетом лимитов Telegram."""
-    for i in range(0, len(user_ids), batch_size):
-        batch = user_ids[i:i + batch_size]
-        tasks = [bot.send_message(chat_id=user_id, text=message_text, reply_markup=ReplyKeyboardRemove()) for user_id in batch]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        for user_id, result in zip(batch, results):
-            if isinstance(result, Exception):
-                logger.warning(f"Не удалось отправить сообщение user_id={user_id}: {result}")
-            else:
-                logger.debug(f"Сообщение отправлено user_id={user_id}")
-        await asyncio.sleep(1)  # Пауза 1 секунда между партиями (30 сообщений/сек)
+# Ссылки на фоновые задачи запуска
+background_tasks: Set[asyncio.Task] = set()
+
+def run_in_background(coro) -> asyncio.Task:
+    """Запускает корутину в фоне, сохраняя ссылку на задачу до ее завершения."""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def warm_known_users() -> None:
+    """Прогревает индекс известных пользователей для /start."""
+    try:
+        async with session_maker() as session:
+            await known_users.warm(session)
+    except Exception as e:
+        logger.error(f"Ошибка прогрева индекса пользователей: {e}")
+
+async def send_message_to_all_users(bot: Bot, session: AsyncSession, message_text: str, kind: str = "send",
+                                    dedup_window: int = 0) -> bool:
+    """Запускает в фоне сохраняемую задачу рассылки сообщения всем пользователям.
 
-async def send_message_to_all_users(bot: Bot, session: AsyncSession, message_text: str) -> None:
-    """Отправляет сообщение всем пользователям из кэша или базы."""
-    global USER_IDS_CACHE
+    При dedup_window рассылка не создается (False), если рассылка вида kind уже была
+    за последние dedup_window секунд, в том числе из другого процесса, стартовавшего одновременно.
+    """
     try:
-        if not USER_IDS_CACHE:
-            USER_IDS_CACHE = await fetch_user_ids(session)
-        await send_message_batch(bot, USER_IDS_CACHE, message_text)
-        logger.info(f"Сообщения отправлены {len(USER_IDS_CACHE)} пользователям")
+        if dedup_window:
+            since = utcnow() - timedelta(seconds=dedup_window)
+            # Общий для всех процессов ключ окна: вторая вставка в том же окне упрется в уникальный индекс
+            dedup_key = f"{kind}:{int(time() // dedup_window)}"
+            job = await run_write(session, orm_create_broadcast_job_once, kind, since, dedup_key, text=message_text)
+            if job is None:
+                return False
+        else:
+            job = await run_write(session, orm_create_broadcast_job, kind=kind, text=message_text)
+            if job is None:
+                raise RuntimeError("Не удалось создать задачу рассылки")
+        spawn_broadcast_job(bot, session_maker, job.id)
+        return True
     except Exception as e:
         logger.error(f"Ошибка при отправке сообщений всем пользователям: {e}")
         raise
 
-def get_startup_handler(reset_db: bool):
+async def notify_startup(bot: Bot) -> None:
+    """Рассылает сообщение о запуске, если за последнее окно дедупликации его еще не было."""
+    try:
+        welcome_message = (
+            "📢 Бот запущен!\n"
+            "Напишите команду /start для продолжения работы.✏"
+        )
+        async with session_maker() as session:
+            if not await send_message_to_all_users(bot, session, welcome_message, kind="startup",
+                                                   dedup_window=settings.startup_notify_window):
+                logger.info("Сообщение о запуске уже рассылалось недавно, пропускаем")
+    except Exception as e:
+        logger.error(f"Ошибка рассылки сообщения о запуске: {e}")
+
+async def log_update_stats_periodically(ordering: UserOrderingMiddleware, db_session: DataBaseSession,
+                                       interval: float) -> None:
+    """Периодически пишет в лог загрузку обработки апдейтов и долю апдейтов, которым нужна БД."""
+    while True:
+        await asyncio.sleep(interval)
+        stats = ordering.stats()
+        db_stats = db_session.stats()
+        db_share = db_stats["with_db"] / db_stats["updates"] if db_stats["updates"] else 0.0
+        logger.info(
+            f"Апдейты: в работе {stats['running']}, ждут {stats['waiting']}, "
+            f"пользователей в обработке {stats['users']}, самая длинная очередь {stats['max_user_depth']}; "
+            f"всего {db_stats['updates']}, с обращением к БД {db_stats['with_db']} ({db_share:.0%})"
+        )
+
+def get_startup_handler(reset_db: bool, storage: Union[SQLAlchemyStorage, BoundedMemoryStorage],
+                        ordering: UserOrderingMiddleware, db_session: DataBaseSession):
     async def startup(bot: Bot) -> None:
-        """Выполняется при запуске бота: инициализация БД и отправка сообщений."""
+        """Выполняется при запуске бота: инициализация БД и фоновые рассылки."""
         try:
             if reset_db:
                 await drop_db()
                 logger.info("База данных сброшена")
             await create_db()
             logger.info("База данных инициализирована")
+            if write_queue is not None:
+                write_queue.start()
+                logger.info("Запись из обработчиков идет через очередь писателя")
 
-            # Отправка сообщения всем пользователям
-            async with session_maker() as session:
-                welcome_message = (
-                    "📢 Бот запущен!\n"
-                    "Напишите команду /start для продолжения работы.✏"
-                )
-                await send_message_to_all_users(bot, session, welcome_message)
+            # Продолжение рассылок, прерванных перезапуском
+            await resume_broadcast_jobs(bot, session_maker)
+
+            # Фоновые задачи, прогрев индекса и сообщение о запуске не задерживают начало polling
+            run_in_background(warm_known_users())
+            run_in_background(sweep_periodically([storage.store, user_status.store], settings.ttl_sweep_interval))
+            run_in_background(purge_tokens_periodically(token_store, settings.ttl_sweep_interval))
+            # Отправка писем из очереди, в том числе оставшихся с прошлого запуска
+            run_in_background(mail_outbox.run(bot))
+            # Рассылки процессов, которые упали, не дойдя до конца
+            run_in_background(resume_broadcast_jobs_periodically(bot, session_maker))
+            run_in_background(log_update_stats_periodically(ordering, db_session, settings.stats_log_interval))
+            if settings.startup_notify:
+                run_in_background(notify_startup(bot))
         except Exception as e:
             logger.error(f"Ошибка при запуске бота: {e}")
             raise
     return startup
 
 
-async def on_shutdown(bot):
-    logger.info("Бот остановлен")
+def get_shutdown_handler(storage: Union[SQLAlchemyStorage, BoundedMemoryStorage]):
+    async def on_shutdown(bot: Bot) -> None:
+        """Выполняется при остановке бота: запись накопленного и закрытие соединений."""
+        # Прерванные рассылки и несохраненные состояния FSM пишутся до остановки очереди записи
+        await stop_broadcast_jobs()
+        await storage.close()
+        if write_queue is not None:
+            await write_queue.close()
+        await smtp_pool.close()
+        logger.info("Бот остановлен")
+    return on_shutdown
 
 async def main():
     parser = argparse.ArgumentParser(description="Запуск бота конкурса «РЕПИН НАШ!»")
     parser.add_argument("--reset-db", action="store_true", help="Сбросить базу данных при запуске")
+    parser.add_argument("--webhook", action="store_true", help="Принимать апдейты через вебхук вместо polling")
     args = parser.parse_args()
 
     # Оптимизация пула соединений для высокой нагрузки
     bot = Bot(token=settings.bot_token, default=DefaultBotProperties(parse_mode="HTML"))
-    dp = Dispatcher()
+    if settings.fsm_storage == "db":
+        storage = SQLAlchemyStorage(session_maker, cache_ttl=settings.fsm_cache_ttl, cache_max_size=settings.fsm_max_users)
+    else:
+        storage = BoundedMemoryStorage(ttl=settings.fsm_state_ttl, max_size=settings.fsm_max_users)
+    # Блокировка пользователя берется до чтения FSM-состояния: его апдейты идут строго по порядку
+    isolation = UserEventIsolation()
+    dp = Dispatcher(storage=storage, events_isolation=isolation)
+    # Параллельная обработка разных пользователей (порядок одного пользователя - за isolation)
+    ordering = UserOrderingMiddleware(max_concurrency=settings.max_concurrent_updates, isolation=isolation)
+    # Сессия базы данных открывается только при первом обращении обработчика
+    db_session = DataBaseSession(session_pool=session_maker)
 
     # Регистрация обработчиков запуска и остановки
-    dp.startup.register(get_startup_handler(args.reset_db))
-    dp.shutdown.register(on_shutdown)
+    dp.startup.register(get_startup_handler(args.reset_db, storage, ordering, db_session))
+    dp.shutdown.register(get_shutdown_handler(storage))
 
-    # Middleware для сессии базы данных
-    dp.update.middleware(DataBaseSession(session_pool=session_maker))
+    dp.update.outer_middleware(ordering)
+    dp.update.middleware(db_session)
+    if isinstance(storage, SQLAlchemyStorage):
+        # Изменения FSM за апдейт пишутся в базу одной транзакцией
+        dp.update.middleware(FSMFlushMiddleware(storage))
 
     # Подключение роутеров
     dp.include_router(user_private_router)
@@ -121,16 +207,12 @@ async def main():
     async def start(message: Message, state: FSMContext, session: AsyncSession):
         try:
             user_id = message.from_user.id
-            if user_id not in USER_IDS_CACHE:
-                if not await orm_Check_avail_user(session, user_id):
-                    info_user = {
-                        "user_id": user_id,
-                        "nickname": message.from_user.username or "не установлен"
-                    }
-                    await orm_AddUser(session, info_user)
-                    USER_IDS_CACHE.append(user_id)  # Обновляем кэш
-
-            user_name = await orm_Check_register_user(session, user_id)
+            # Повторный /start - из кэша, известный пользователь - один SELECT, новый - upsert и SELECT.
+            # Три запроса - известный пользователь, которого другой процесс отметил недоступным
+            with query_budget("start", 3):
+                user_name = await user_status.registration_name(
+                    session, user_id, message.from_user.username or "не установлен"
+                )
             if settings.prod:
                 if not user_name:
                     await state.set_state(User_MainStates.before_registration)
@@ -177,11 +259,15 @@ async def main():
             await message.answer("Извините, что-то пошло не так. Попробуйте позже")
 
     # Установка команд и запуск бота
-    await bot.delete_webhook(drop_pending_updates=True)
     await bot.set_my_commands(commands=private, scope=BotCommandScopeAllPrivateChats())
     # await bot.delete_my_commands()
+    if args.webhook:
+        logger.info("Запуск вебхука...")
+        await run_webhook(dp, bot, allowed_updates=dp.resolve_used_update_types(), drop_pending_updates=True)
+        return
+    await bot.delete_webhook(drop_pending_updates=True)
     logger.info("Запуск polling...")
-    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types(), handle_as_tasks=True)
 
 if __name__ == "__main__":
     asyncio.run(main())
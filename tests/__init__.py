@@ -0,0 +1,36 @@
+import os
+
+# Обязательные настройки config.Settings, чтобы модули бота импортировались без .env
+for name, value in {
+    "BOT_TOKEN": "123456:test",
+    "ADMIN_USER_NICK": "admin",
+    "DB_LITE": "sqlite+aiosqlite:///:memory:",
+    "SMTP_SERVER": "localhost",
+    "PORT": "25",
+    "SENDER_EMAIL": "bot@example.com",
+    "SENDER_PASSWORD": "test",
+}.items():
+    os.environ.setdefault(name, value)
+
+# Модули бота импортируются только после настроек выше
+import unittest
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.database.models import Base
+from app.database.profiles import create_engine_for
+
+
+class DatabaseTestCase(unittest.IsolatedAsyncioTestCase):
+    """Тест с чистой базой: на каждый тест свой движок, таблицы и фабрика сессий."""
+
+    url = "sqlite+aiosqlite:///:memory:"
+
+    async def asyncSetUp(self):
+        self.engine = create_engine_for(self.url)
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        self.session_pool = async_sessionmaker(bind=self.engine, class_=AsyncSession, expire_on_commit=False)
+
+    async def asyncTearDown(self):
+        await self.engine.dispose()
@@ -0,0 +1,118 @@
+import asyncio
+import unittest
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+from sqlalchemy import select
+
+from app.bot.common import broadcast
+from app.bot.common.token_store import utcnow
+from app.database.models import BroadcastDelivery, BroadcastJob, User
+from app.database.orm_query import (
+    orm_acquire_broadcast_job,
+    orm_claim_broadcast_chunk,
+    orm_create_broadcast_job,
+    orm_create_broadcast_job_once,
+)
+from tests import DatabaseTestCase
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        self.sent.append(chat_id)
+
+
+class BroadcastLeaseTest(DatabaseTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        async with self.session_pool() as session:
+            session.add_all([User(user_id=user_id, nickname="u") for user_id in range(1, 6)])
+            await session.commit()
+            self.job_id = (await orm_create_broadcast_job(session, "send", text="hi")).id
+        broadcast.broadcast_engine = broadcast.BroadcastEngine(rate=1000, max_rate=1000)
+
+    async def test_job_has_one_owner_until_lease_expires(self):
+        now = utcnow()
+        lease = broadcast.BROADCAST_LEASE
+        async with self.session_pool() as session:
+            self.assertTrue(await orm_acquire_broadcast_job(session, self.job_id, "a", now, now + lease))
+            self.assertFalse(await orm_acquire_broadcast_job(session, self.job_id, "b", now, now + lease))
+            self.assertEqual(await orm_claim_broadcast_chunk(session, self.job_id, 2, "a", now + lease), [1, 2])
+            # Процесс a завис: аренда истекла, задачу забирает b, a больше порций не получает
+            later = now + lease * 2
+            self.assertTrue(await orm_acquire_broadcast_job(session, self.job_id, "b", later, later + lease))
+            self.assertIsNone(await orm_claim_broadcast_chunk(session, self.job_id, 2, "a", later + lease))
+            # Невыданные отметки a достаются b, а не отправляются повторно обоими
+            self.assertEqual(await orm_claim_broadcast_chunk(session, self.job_id, 2, "b", later + lease), [1, 2])
+
+    async def test_second_process_does_not_resend_job(self):
+        first, second = FakeBot(), FakeBot()
+        await broadcast.run_broadcast_job(first, self.session_pool, self.job_id, chunk_size=2, owner="a")
+        await broadcast.run_broadcast_job(second, self.session_pool, self.job_id, chunk_size=2, owner="b")
+        self.assertEqual(first.sent, [1, 2, 3, 4, 5])
+        self.assertEqual(second.sent, [])
+        async with self.session_pool() as session:
+            job = await session.get(BroadcastJob, self.job_id)
+            statuses = (await session.execute(select(BroadcastDelivery.status))).scalars().all()
+        self.assertEqual((job.status, job.claimed_by, job.sent), ("done", None, 5))
+        self.assertEqual(set(statuses), {"sent"})
+
+    async def test_stopped_job_releases_lease_and_keeps_progress(self):
+        release = asyncio.Event()
+
+        class StallingBot(FakeBot):
+            async def send_message(self, chat_id, text, reply_markup=None):
+                if chat_id == 3:
+                    await release.wait()
+                await super().send_message(chat_id, text, reply_markup)
+
+        first, second = StallingBot(), FakeBot()
+        broadcast.broadcast_engine = broadcast.BroadcastEngine(rate=1000, max_rate=1000, concurrency=1)
+        task = asyncio.create_task(broadcast.run_broadcast_job(first, self.session_pool, self.job_id, owner="a"))
+        while len(first.sent) < 2:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        async with self.session_pool() as session:
+            job = await session.get(BroadcastJob, self.job_id)
+        self.assertEqual((job.status, job.claimed_by, job.lease_until, job.sent), ("running", None, None, 2))
+        # Другой процесс забирает задачу сразу, не дожидаясь аренды, и не повторяет отправленное
+        await broadcast.run_broadcast_job(second, self.session_pool, self.job_id, owner="b")
+        self.assertEqual(second.sent, [3, 4, 5])
+
+    async def test_startup_job_is_created_once_per_window(self):
+        since = utcnow() - broadcast.BROADCAST_LEASE
+        async with self.session_pool() as session:
+            self.assertIsNotNone(await orm_create_broadcast_job_once(session, "startup", since, "startup:1", text="hi"))
+            self.assertIsNone(await orm_create_broadcast_job_once(session, "startup", since, "startup:1", text="hi"))
+            # Второй процесс проверил раньше, чем первый вставил: вставку отсекает уникальный ключ
+            later = utcnow()
+            self.assertIsNone(await orm_create_broadcast_job_once(session, "startup", later, "startup:1", text="hi"))
+            jobs = (await session.execute(select(BroadcastJob.id).where(BroadcastJob.kind == "startup"))).all()
+        self.assertEqual(len(jobs), 1)
+
+
+class RetryAfterTest(unittest.IsolatedAsyncioTestCase):
+    async def test_burst_of_429_halves_rate_once(self):
+        engine = broadcast.BroadcastEngine(rate=20, min_rate=1, max_rate=30, concurrency=10, per_chat_interval=0)
+        flooded = set()
+
+        async def send(chat_id):
+            # Первая попытка каждой из 10 одновременных отправок получает 429
+            if chat_id not in flooded:
+                flooded.add(chat_id)
+                await asyncio.sleep(0.01)
+                raise TelegramRetryAfter(SendMessage(chat_id=chat_id, text="x"), "Flood control exceeded", 0.1)
+
+        result = await engine.broadcast(range(1, 11), send)
+        self.assertEqual(len(result.delivered), 10)
+        self.assertEqual(result.retries, 10)
+        self.assertGreaterEqual(engine.bucket.rate, 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+
+from aiogram.fsm.storage.base import StorageKey
+
+from app.bot.FSM.storage import SQLAlchemyStorage
+from tests import DatabaseTestCase
+
+KEY = StorageKey(bot_id=1, chat_id=1, user_id=1)
+
+
+class SQLAlchemyStorageTest(DatabaseTestCase):
+    async def test_uncached_storage_sees_other_process_writes(self):
+        # Два процесса с одной базой: апдейты пользователя приходят то в один, то в другой
+        first = SQLAlchemyStorage(self.session_pool, cache_ttl=0, cache_max_size=10)
+        second = SQLAlchemyStorage(self.session_pool, cache_ttl=0, cache_max_size=10)
+        await first.set_state(KEY, "form:name")
+        await first.flush()
+        self.assertEqual(await second.get_state(KEY), "form:name")
+        await second.set_state(KEY, "form:school")
+        await second.flush()
+        self.assertEqual(await first.get_state(KEY), "form:school")
+
+    async def test_cache_is_not_extended_by_reads(self):
+        storage = SQLAlchemyStorage(self.session_pool, cache_ttl=60, cache_max_size=10)
+        self.assertIsNone(await storage.get_state(KEY))
+        await storage.get_state(KEY)
+        self.assertEqual(storage.reads, 1)
+        self.assertFalse(storage.store.refresh_on_get)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import asyncio
+import os
+import unittest
+from datetime import timedelta
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.database.engine import upgrade_schema
+from app.database.models import Base, BroadcastJob, User, utcnow
+from app.database.orm_query import (
+    orm_AddUser, orm_acquire_broadcast_job, orm_claim_broadcast_chunk, orm_consume_verification_token,
+    orm_create_broadcast_job, orm_ensure_user, orm_get_fsm_record, orm_has_recent_broadcast_job,
+    orm_put_verification_token, orm_register_user, orm_save_fsm_records
+)
+from app.database.profiles import create_engine_for
+from app.database.writer import WriteQueue, create_writer_engine
+from config import asyncpg_url
+
+# Пустая тестовая база PostgreSQL: таблицы создаются и удаляются тестом.
+# Например: TEST_DATABASE_URL=postgresql://postgres@localhost/bot_test python -m unittest tests.test_postgres
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+# Telegram ID больше 2^31: в INTEGER PostgreSQL не помещается
+BIG_ID = 7_000_000_000
+
+
+class AsyncpgUrlTest(unittest.TestCase):
+    def test_postgres_urls_use_asyncpg(self):
+        self.assertEqual(asyncpg_url("postgres://u:p@h:5432/db?sslmode=require"),
+                         "postgresql+asyncpg://u:p@h:5432/db?ssl=require")
+        self.assertEqual(asyncpg_url("postgresql://u@h/db"), "postgresql+asyncpg://u@h/db")
+        self.assertEqual(asyncpg_url("sqlite+aiosqlite:///bot.db"), "sqlite+aiosqlite:///bot.db")
+
+
+@unittest.skipUnless(TEST_DATABASE_URL, "TEST_DATABASE_URL не задан")
+class PostgresTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.url = asyncpg_url(TEST_DATABASE_URL)
+        self.engine = create_engine_for(self.url)
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+        self.session_pool = async_sessionmaker(bind=self.engine, class_=AsyncSession, expire_on_commit=False)
+
+    async def asyncTearDown(self):
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+        await self.engine.dispose()
+
+    async def test_schema_upgrade_is_idempotent(self):
+        async with self.engine.begin() as conn:
+            await conn.run_sync(upgrade_schema)
+
+    async def test_user_upserts_with_bigint_ids(self):
+        async with self.session_pool() as session:
+            self.assertIsNone(await orm_ensure_user(session, BIG_ID, "big"))
+            self.assertIsNone(await orm_ensure_user(session, BIG_ID, "big"))
+            data = {"user_id": BIG_ID, "name_user": "Иванов Иван", "school": "1", "phone_number": "+79990000000",
+                    "mail": "a@example.com", "name_mentor": "Петров"}
+            self.assertTrue(await orm_register_user(session, data))
+            self.assertTrue(await orm_register_user(session, data))
+            self.assertEqual(await orm_ensure_user(session, BIG_ID, "big"), "Иванов Иван")
+
+    async def test_fsm_and_token_upserts(self):
+        async with self.session_pool() as session:
+            self.assertTrue(await orm_save_fsm_records(session, {"k": ("S:a", "{}")}))
+            self.assertTrue(await orm_save_fsm_records(session, {"k": ("S:b", '{"x": 1}')}))
+            self.assertEqual(tuple(await orm_get_fsm_record(session, "k")), ("S:b", '{"x": 1}'))
+            self.assertTrue(await orm_save_fsm_records(session, {"k": (None, None)}))
+            self.assertIsNone(await orm_get_fsm_record(session, "k"))
+
+            expires = utcnow() + timedelta(minutes=5)
+            self.assertTrue(await orm_put_verification_token(session, BIG_ID, "old", expires))
+            self.assertTrue(await orm_put_verification_token(session, BIG_ID, "new", expires))
+            self.assertFalse(await orm_consume_verification_token(session, BIG_ID, "old", utcnow()))
+            self.assertTrue(await orm_consume_verification_token(session, BIG_ID, "new", utcnow()))
+            self.assertFalse(await orm_consume_verification_token(session, BIG_ID, "new", utcnow()))
+
+    async def test_broadcast_claim_insert_select_returning(self):
+        now = utcnow()
+        lease = now + timedelta(minutes=10)
+        async with self.session_pool() as session:
+            session.add_all([User(user_id=BIG_ID + i, nickname="u") for i in range(5)])
+            session.add(User(user_id=1, nickname="gone", unreachable=True))
+            await session.commit()
+            job = await orm_create_broadcast_job(session, "forward", from_chat_id=-1001234567890, message_id=1)
+            job_id = job.id
+            self.assertTrue(await orm_has_recent_broadcast_job(session, "forward", now - timedelta(seconds=5)))
+            self.assertTrue(await orm_acquire_broadcast_job(session, job_id, "a", now, lease))
+            self.assertFalse(await orm_acquire_broadcast_job(session, job_id, "b", now, lease))
+            first = await orm_claim_broadcast_chunk(session, job_id, 3, "a", lease)
+            self.assertEqual(first, [BIG_ID, BIG_ID + 1, BIG_ID + 2])
+            # Неотмеченная порция выдается повторно тому же владельцу
+            self.assertEqual(await orm_claim_broadcast_chunk(session, job_id, 3, "a", lease), first)
+            self.assertIsNone(await orm_claim_broadcast_chunk(session, job_id, 3, "b", lease))
+            cursor = (await session.execute(select(BroadcastJob.cursor).where(BroadcastJob.id == job_id))).scalar()
+            self.assertEqual(cursor, BIG_ID + 2)
+
+    async def test_write_queue_batch(self):
+        queue = WriteQueue(create_writer_engine(self.url), max_batch=10, max_delay=0.2)
+        queue.start()
+        try:
+            results = await asyncio.gather(
+                queue.submit(orm_AddUser, {"user_id": BIG_ID, "nickname": "a"}),
+                queue.submit(orm_AddUser, {"user_id": BIG_ID, "nickname": "dup"}),
+                queue.submit(orm_AddUser, {"user_id": BIG_ID + 1, "nickname": "b"}),
+            )
+        finally:
+            await queue.close()
+        self.assertEqual([r is not None for r in results], [True, False, True])
+        self.assertEqual((queue.batches, queue.fallbacks), (1, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import asyncio
+import unittest
+from email.message import EmailMessage
+
+import aiosmtplib
+
+from app.bot.common.smtp_pool import SMTPPool
+
+
+class FakeSMTPServer:
+    """Минимальный SMTP-сервер в процессе теста: принимает письма и умеет обрывать соединения."""
+
+    def __init__(self, reject_auth: bool = False):
+        self.reject_auth = reject_auth
+        self.messages = []
+        self.connections = 0  # Всего принятых соединений
+        self._writers = set()  # Открытые соединения
+        self._server = None
+
+    @property
+    def open_connections(self) -> int:
+        return len(self._writers)
+
+    async def start(self) -> int:
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self.drop_connections()
+        self._server.close()
+        await self._server.wait_closed()
+
+    def drop_connections(self) -> None:
+        for writer in list(self._writers):
+            writer.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        self._writers.add(writer)
+        try:
+            writer.write(b"220 localhost ESMTP\r\n")
+            while line := await reader.readline():
+                command = line.decode().strip().upper()
+                if command.startswith("EHLO"):
+                    writer.write(b"250-localhost\r\n250 AUTH PLAIN LOGIN\r\n")
+                elif command.startswith("AUTH"):
+                    writer.write(b"535 Authentication failed\r\n" if self.reject_auth else b"235 OK\r\n")
+                elif command == "DATA":
+                    writer.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                    await writer.drain()
+                    data = []
+                    while (data_line := await reader.readline()) not in (b".\r\n", b""):
+                        data.append(data_line)
+                    self.messages.append(b"".join(data))
+                    writer.write(b"250 OK\r\n")
+                elif command == "QUIT":
+                    writer.write(b"221 Bye\r\n")
+                    await writer.drain()
+                    break
+                else:
+                    writer.write(b"250 OK\r\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+
+def make_message(n: int) -> EmailMessage:
+    message = EmailMessage()
+    message["From"] = "bot@example.com"
+    message["To"] = "user@example.com"
+    message["Subject"] = f"Код {n}"
+    message.set_content(str(n))
+    return message
+
+
+class SMTPPoolTest(unittest.IsolatedAsyncioTestCase):
+    async def start_server(self, **kwargs) -> SMTPPool:
+        self.server = FakeSMTPServer(**kwargs)
+        port = await self.server.start()
+        self.pool = SMTPPool("127.0.0.1", port, username="bot", password="secret", size=1,
+                             use_tls=False, start_tls=False, timeout=5)
+        return self.pool
+
+    async def asyncTearDown(self):
+        await self.pool.close()
+        await self.server.stop()
+
+    async def test_reuses_connection(self):
+        pool = await self.start_server()
+        for n in range(3):
+            await pool.send_message(make_message(n))
+        self.assertEqual(len(self.server.messages), 3)
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(pool.connects, 1)
+        self.assertEqual(pool.reuses, 2)
+
+    async def test_reconnects_after_server_drops_connection(self):
+        pool = await self.start_server()
+        await pool.send_message(make_message(1))
+        self.server.drop_connections()
+        await asyncio.sleep(0.05)
+        await pool.send_message(make_message(2))
+        self.assertEqual(len(self.server.messages), 2)
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(pool.connects, 2)
+
+    async def test_failed_login_closes_connection(self):
+        pool = await self.start_server(reject_auth=True)
+        for _ in range(2):
+            with self.assertRaises(aiosmtplib.SMTPAuthenticationError):
+                await pool.send_message(make_message(1))
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(self.server.open_connections, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,22 @@
+import unittest
+
+from app.bot.common.token_store import MemoryTokenStore
+
+
+class MemoryTokenStoreTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.store = MemoryTokenStore(ttl=60, max_size=10)
+        await self.store.put(1, "123456")
+
+    async def test_non_ascii_code_is_rejected(self):
+        self.assertFalse(await self.store.consume(1, "привет"))
+        # Неверный ответ не сжигает код
+        self.assertTrue(await self.store.consume(1, "123456"))
+
+    async def test_code_is_consumed_once(self):
+        self.assertTrue(await self.store.consume(1, "123456"))
+        self.assertFalse(await self.store.consume(1, "123456"))
+
+
+if __name__ == "__main__":
+    unittest.main()
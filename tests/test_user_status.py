@@ -0,0 +1,88 @@
+import unittest
+
+from sqlalchemy import select
+
+from app.bot.common.known_users import KnownUsersIndex
+from app.bot.common.user_status import UserStatusCache
+from app.database.models import ActiveUser, User
+from app.database.orm_query import orm_iter_user_ids
+from app.database.query_budget import install_query_budget, query_budget
+from tests import DatabaseTestCase
+
+
+class UserStatusTest(DatabaseTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        install_query_budget(self.engine)
+        async with self.session_pool() as session:
+            session.add_all([
+                User(user_id=1, nickname="a", reg_status=True),
+                User(user_id=2, nickname="b", unreachable=True, unreachable_reason="forbidden"),
+                User(user_id=3, nickname="c"),
+            ])
+            await session.flush()
+            session.add(ActiveUser(user_id=1, name="Иванов Иван", school="1", phone_number="+79990000000",
+                                   mail="a@example.com", name_mentor="Петров Петр"))
+            await session.commit()
+        self.index = KnownUsersIndex()
+        async with self.session_pool() as session:
+            await self.index.warm(session)
+
+    async def registration_name(self, cache: UserStatusCache, user_id: int):
+        async with self.session_pool() as session:
+            with query_budget("start", 3) as counter:
+                name = await cache.registration_name(session, user_id, "nick")
+        return name, counter.count
+
+    async def test_warm_skips_unreachable_users(self):
+        self.assertEqual([user_id in self.index for user_id in (1, 2, 3, 4)], [True, False, True, False])
+        self.assertTrue(self.index.warmed)
+
+    async def test_iter_user_ids_streams_in_chunks(self):
+        async with self.session_pool() as session:
+            self.assertEqual([chunk async for chunk in orm_iter_user_ids(session, chunk_size=2)], [[1, 2], [3]])
+            self.assertEqual([chunk async for chunk in orm_iter_user_ids(session, chunk_size=1, reachable_only=True)],
+                             [[1], [3]])
+
+    async def test_known_user_is_read_without_upsert(self):
+        cache = UserStatusCache(ttl=60, max_size=10, index=self.index)
+        self.assertEqual(await self.registration_name(cache, 1), ("Иванов Иван", 1))
+        self.assertEqual(await self.registration_name(cache, 3), (None, 1))
+        # Повторный /start - из кэша
+        self.assertEqual(await self.registration_name(cache, 1), ("Иванов Иван", 0))
+
+    async def test_new_and_unreachable_users_go_through_upsert(self):
+        cache = UserStatusCache(ttl=60, max_size=10, index=self.index)
+        self.assertEqual(await self.registration_name(cache, 4), (None, 2))
+        self.assertEqual(await self.registration_name(cache, 2), (None, 2))
+        self.assertIn(4, self.index)
+        self.assertIn(2, self.index)
+        async with self.session_pool() as session:
+            users = (await session.execute(select(User.user_id, User.unreachable).order_by(User.user_id))).all()
+        self.assertEqual([tuple(user) for user in users], [(1, False), (2, False), (3, False), (4, False)])
+
+    async def test_forgotten_user_is_marked_reachable_again(self):
+        cache = UserStatusCache(ttl=60, max_size=10, index=self.index)
+        await self.registration_name(cache, 3)
+        async with self.session_pool() as session:
+            await session.execute(User.__table__.update().where(User.user_id == 3).values(unreachable=True))
+            await session.commit()
+        cache.forget(3)
+        self.assertNotIn(3, self.index)
+        self.assertEqual(await self.registration_name(cache, 3), (None, 2))
+        async with self.session_pool() as session:
+            self.assertFalse(await session.scalar(select(User.unreachable).where(User.user_id == 3)))
+
+    async def test_known_user_marked_unreachable_elsewhere_is_reenabled(self):
+        # Отметку поставил другой процесс: индекс этого процесса о ней не знает
+        async with self.session_pool() as session:
+            await session.execute(User.__table__.update().where(User.user_id == 3).values(unreachable=True))
+            await session.commit()
+        cache = UserStatusCache(ttl=60, max_size=10, index=self.index)
+        self.assertEqual(await self.registration_name(cache, 3), (None, 3))
+        async with self.session_pool() as session:
+            self.assertFalse(await session.scalar(select(User.unreachable).where(User.user_id == 3)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import asyncio
+import unittest
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Message
+from aiohttp.test_utils import TestClient, TestServer
+
+from app.bot.webhook import WEBHOOK_HANDLER_KEY, create_webhook_app
+
+SECRET = "test-secret"
+PATH = "/webhook"
+
+
+def message_update(update_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": update_id, "type": "private"},
+            "from": {"id": update_id, "is_bot": False, "first_name": "test"},
+            "text": "hi",
+        },
+    }
+
+
+class WebhookTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        # Обработчик держит апдейты в работе, пока тест не отпустит их
+        self.release = asyncio.Event()
+        self.handled = []
+        dp = Dispatcher()
+
+        @dp.message()
+        async def hold(message: Message):
+            self.handled.append(message.message_id)
+            await self.release.wait()
+
+        self.bot = Bot(token="123456:test")
+        app = create_webhook_app(dp, self.bot, SECRET, path=PATH, max_in_flight=2)
+        self.handler = app[WEBHOOK_HANDLER_KEY]
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        self.release.set()
+        await self.client.close()
+
+    async def post(self, update_id: int, secret: str = SECRET):
+        headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+        return await self.client.post(PATH, json=message_update(update_id), headers=headers)
+
+    async def test_rejects_requests_without_secret(self):
+        self.assertEqual((await self.post(1, secret=None)).status, 401)
+        self.assertEqual((await self.post(2, secret="wrong")).status, 401)
+        self.assertEqual(self.handler.in_flight, 0)
+
+    async def test_rejects_updates_above_max_in_flight(self):
+        self.assertEqual((await self.post(1)).status, 200)
+        self.assertEqual((await self.post(2)).status, 200)
+        self.assertEqual(self.handler.in_flight, 2)
+
+        response = await self.post(3)
+        self.assertEqual(response.status, 503)
+        self.assertEqual(self.handler.rejected, 1)
+
+        # Освободившийся слот снова принимает апдейты
+        self.release.set()
+        while self.handler.in_flight:
+            await asyncio.sleep(0.01)
+        self.assertEqual((await self.post(3)).status, 200)
+        while self.handler.in_flight:
+            await asyncio.sleep(0.01)
+        self.assertEqual(sorted(self.handled), [1, 2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
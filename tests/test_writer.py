@@ -0,0 +1,94 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from aiogram.fsm.storage.base import StorageKey
+from sqlalchemy import select
+
+from app.bot.FSM.storage import SQLAlchemyStorage
+from app.database import writer
+from app.database.models import User
+from app.database.orm_query import orm_AddUser, orm_ensure_user, orm_get_fsm_record
+from app.database.query_budget import install_query_budget, query_budget
+from app.database.writer import WriteQueue, create_writer_engine
+from tests import DatabaseTestCase
+
+
+class WriteQueueTest(DatabaseTestCase):
+    async def asyncSetUp(self):
+        # Писатель и читатели работают с одним файлом базы через разные движки
+        self.tmp = tempfile.TemporaryDirectory()
+        self.url = f"sqlite+aiosqlite:///{os.path.join(self.tmp.name, 'bot.db')}"
+        await super().asyncSetUp()
+        # Пакет собирается целиком, пока писатель ждет
+        self.queue = WriteQueue(create_writer_engine(self.url), max_batch=10, max_delay=0.2)
+        self.queue.start()
+
+    async def asyncTearDown(self):
+        await self.queue.close()
+        await super().asyncTearDown()
+        self.tmp.cleanup()
+
+    async def user_ids(self):
+        async with self.session_pool() as session:
+            return (await session.execute(select(User.user_id).order_by(User.user_id))).scalars().all()
+
+    async def test_failed_op_does_not_break_batch(self):
+        results = await asyncio.gather(
+            self.queue.submit(orm_AddUser, {"user_id": 1, "nickname": "a"}),
+            self.queue.submit(orm_AddUser, {"user_id": 2, "nickname": "b"}),
+            # Повтор первичного ключа: IntegrityError при flush
+            self.queue.submit(orm_AddUser, {"user_id": 1, "nickname": "dup"}),
+            self.queue.submit(orm_AddUser, {"user_id": 3, "nickname": "c"}),
+        )
+        self.assertEqual([r is not None for r in results], [True, True, False, True])
+        self.assertEqual(await self.user_ids(), [1, 2, 3])
+        self.assertEqual((self.queue.batches, self.queue.fallbacks), (1, 0))
+
+    async def test_op_exception_reaches_caller(self):
+        async def broken(session):
+            session.add(User(user_id=5, nickname="x"))
+            await session.flush()
+            raise ValueError("broken")
+
+        results = await asyncio.gather(
+            self.queue.submit(broken),
+            self.queue.submit(orm_AddUser, {"user_id": 6, "nickname": "y"}),
+            return_exceptions=True,
+        )
+        self.assertIsInstance(results[0], ValueError)
+        self.assertEqual(await self.user_ids(), [6])
+        self.assertEqual(self.queue.fallbacks, 0)
+
+    async def test_writer_queries_count_into_caller_budget(self):
+        install_query_budget(self.queue.engine)
+        with query_budget("start", 2) as counter:
+            self.assertIsNone(await self.queue.submit(orm_ensure_user, 7, "z"))
+        self.assertEqual(counter.count, 2, counter.statements)
+
+    async def test_fsm_flush_goes_through_queue(self):
+        writer._write_queue = self.queue
+        self.addCleanup(setattr, writer, "_write_queue", None)
+        storage = SQLAlchemyStorage(self.session_pool, cache_ttl=60, cache_max_size=10)
+        key = StorageKey(bot_id=1, chat_id=8, user_id=8)
+        await storage.set_state(key, "form:name")
+        await storage.update_data(key, {"name": "x"})
+        await storage.flush()
+        self.assertEqual(self.queue.ops, 1)
+        async with self.session_pool() as session:
+            record = await orm_get_fsm_record(session, storage._db_key(key))
+        self.assertEqual(record.state, "form:name")
+
+    async def test_close_runs_ops_submitted_while_closing(self):
+        closing = asyncio.create_task(self.queue.close())
+        await asyncio.sleep(0)
+        self.assertFalse(self.queue.running)
+        late = asyncio.create_task(self.queue.submit(orm_AddUser, {"user_id": 9, "nickname": "late"}))
+        await closing
+        self.assertIsNotNone(await late)
+        self.assertEqual(await self.user_ids(), [9])
+
+
+if __name__ == "__main__":
+    unittest.main()